@@ -0,0 +1,63 @@
+"""
+bench_escape.py: Benchmark for escaping functions in ``bottle_utils.common``
+
+Compares the current implementations of ``html_escape()`` and
+``attr_escape()`` to the original ones, which called ``replace()`` once per
+entry in the escape mapping.
+
+Run from the source directory::
+
+    PYTHONPATH=. python benchmarks/bench_escape.py
+"""
+
+from __future__ import print_function, unicode_literals
+
+import timeit
+
+from bottle_utils import common
+
+INPUTS = (
+    ('short', 'foo-bar'),
+    ('short special', 'a "quoted" & <b>'),
+    ('long', 'x' * 5000),
+    ('long special', 'lorem <b>ipsum</b> & "dolor" ' * 200),
+)
+NUMBER = 20000
+REPEAT = 5
+
+
+def original_html_escape(html):
+    for s, r in common.HTML_ESCAPE_MAPPING:
+        html = html.replace(s, r)
+    return html
+
+
+def original_attr_escape(attr):
+    for s, r in common.ESCAPE_MAPPING:
+        attr = attr.replace(s, r)
+    return attr
+
+
+def best(fn):
+    return min(timeit.repeat(fn, number=NUMBER, repeat=REPEAT))
+
+
+FUNCTIONS = (
+    ('html_escape', original_html_escape, common.html_escape),
+    ('attr_escape', original_attr_escape, common.attr_escape),
+)
+
+
+def main():
+    for fname, original, current in FUNCTIONS:
+        for name, s in INPUTS:
+            assert current(s) == original(s)
+            before = best(lambda: original(s))
+            after = best(lambda: current(s))
+            print('%s %-14s original: %.4fs  current: %.4fs  '
+                  'speedup: %.1fx' % (fname, name, before, after,
+                                      before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+bench_html.py: Benchmark for tag rendering in ``bottle_utils.html``
+
+Compares rendering many elements with ``tag()`` to rendering them with a
+compiled tag.
+
+Run from the source directory::
+
+    PYTHONPATH=. python benchmarks/bench_html.py
+"""
+
+from __future__ import print_function, unicode_literals
+
+import timeit
+
+from bottle_utils.html import tag
+
+ITEMS = [(str(i), 'Option %s' % i) for i in range(1000)]
+NUMBER = 100
+
+
+def render_tag():
+    return ''.join([tag('option', label, _class='choice', value=value)
+                    for value, label in ITEMS])
+
+
+def render_compiled(option=tag.compile('option', _class='choice')):
+    return ''.join([option(label, value=value) for value, label in ITEMS])
+
+
+def main():
+    before = timeit.timeit(render_tag, number=NUMBER)
+    after = timeit.timeit(render_compiled, number=NUMBER)
+    print('%d options  tag(): %.4fs  compiled: %.4fs  speedup: %.1fx' % (
+        len(ITEMS), before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+bench_i18n.py: Benchmark for the per-request overhead of ``I18NPlugin``
+
+Calls a trivial handler through the WSGI interface of a bare bottle app, and
+of the same app with ``I18NPlugin`` installed, and reports requests per
+second for both.
+
+Run from the source directory::
+
+    PYTHONPATH=. python benchmarks/bench_i18n.py
+"""
+
+from __future__ import print_function
+
+import timeit
+import warnings
+
+import bottle
+
+from bottle_utils.i18n import I18NPlugin
+
+LANGS = [('en_US', 'English'), ('de_DE', 'Deutsch'), ('fr_FR', 'French')]
+NUMBER = 20000
+
+
+def make_app():
+    app = bottle.Bottle()
+
+    @app.get('/')
+    def index():
+        return 'Hello'
+
+    return app
+
+
+def make_environ(path, cookie=None):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+               'SCRIPT_NAME': '', 'QUERY_STRING': '', 'SERVER_NAME': 'bench',
+               'SERVER_PORT': '80', 'wsgi.url_scheme': 'http'}
+    if cookie:
+        environ['HTTP_COOKIE'] = cookie
+    return environ
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def requests_per_second(wsgi, path, cookie=None):
+    def call():
+        for chunk in wsgi(make_environ(path, cookie), start_response):
+            pass
+    return NUMBER / timeit.timeit(call, number=NUMBER)
+
+
+def main():
+    bare = make_app()
+    with warnings.catch_warnings():
+        # There are no translation files for the benchmark
+        warnings.simplefilter('ignore')
+        i18n = I18NPlugin(make_app(), LANGS, default_locale='en_US',
+                          locale_dir='nonexistent')
+    base = requests_per_second(bare, '/')
+    plugin = requests_per_second(i18n, '/de_DE/')
+    cookie = requests_per_second(i18n, '/de_DE/', 'locale=de_DE')
+    print('bare: %.0f req/s  plugin: %.0f req/s  plugin with cookie: %.0f '
+          'req/s  overhead: %.1f%%' % (
+              base, plugin, cookie, (base / cookie - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+bench_lazy.py: Benchmark for ``bottle_utils.lazy`` proxies
+
+Compares memory used per proxy object, and the cost of creating and
+evaluating proxies, between the current ``Lazy`` class and the original
+implementation that used per-instance dicts.
+
+Run from the source directory::
+
+    PYTHONPATH=. python benchmarks/bench_lazy.py
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+import functools
+
+from bottle_utils.common import to_unicode
+from bottle_utils.lazy import Lazy
+
+NUMBER = 300000
+
+
+class OriginalLazy(object):
+    def __init__(self, _func, *args, **kwargs):
+        self._func = _func
+        self._args = args
+        self._kwargs = kwargs
+
+    def _eval(self):
+        return self._func(*self._args, **self._kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._eval(), attr)
+
+    def __str__(self):
+        return to_unicode(self._eval())
+
+
+def gettext(message):
+    return message
+
+
+def size_of(obj):
+    # Using object.__getattribute__() because Lazy proxies attribute access
+    get = functools.partial(object.__getattribute__, obj)
+    size = sys.getsizeof(obj) + sys.getsizeof(get('_args'))
+    if get('_kwargs') is not None:
+        size += sys.getsizeof(get('_kwargs'))
+    if isinstance(obj, OriginalLazy):
+        size += sys.getsizeof(get('__dict__'))
+    return size
+
+
+def main():
+    for cls in (OriginalLazy, Lazy):
+        obj = cls(gettext, 'message')
+        create = timeit.timeit(lambda: cls(gettext, 'message'),
+                               number=NUMBER)
+        evaluate = timeit.timeit(lambda: str(obj), number=NUMBER)
+        print('%-12s %4d bytes/proxy  create: %.4fs  str(): %.4fs' % (
+            cls.__name__, size_of(obj), create, evaluate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+bench_translate.py: Benchmark for cached translations in ``bottle_utils.i18n``
+
+Compares translating messages by calling the translation object directly to
+translating them with ``translate()`` and ``translate_plural()``, which cache
+the results.
+
+Run from the source directory::
+
+    PYTHONPATH=. python benchmarks/bench_translate.py
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import timeit
+import gettext
+import tempfile
+
+from bottle_utils.common import to_unicode
+from bottle_utils.i18n import translate, translate_plural
+from bottle_utils.i18n_tools import write_mo
+
+HEADER = ('Content-Type: text/plain; charset=UTF-8\n'
+          'Plural-Forms: nplurals=2; plural=(n != 1);\n')
+NUMBER = 500000
+
+
+def entry(msgid, msgstr, msgid_plural=None):
+    return {'msgctxt': None, 'msgid': msgid, 'msgid_plural': msgid_plural,
+            'msgstr': msgstr, 'fuzzy': False}
+
+
+def make_api(path):
+    write_mo([entry('', [HEADER]),
+              entry('Hello', ['Hallo']),
+              entry('item', ['Artikel', 'Artikel'], 'items')], path)
+    with open(path, 'rb') as f:
+        return gettext.GNUTranslations(f)
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        api = make_api(os.path.join(tmpdir, 'messages.mo'))
+    finally:
+        shutil.rmtree(tmpdir)
+    before = timeit.timeit(lambda: to_unicode(api.gettext('Hello')),
+                           number=NUMBER)
+    after = timeit.timeit(lambda: translate(api, 'Hello'), number=NUMBER)
+    print('gettext   direct: %.4fs  translate(): %.4fs  speedup: %.1fx' % (
+        before, after, before / after))
+    before = timeit.timeit(
+        lambda: to_unicode(api.ngettext('item', 'items', 3)), number=NUMBER)
+    after = timeit.timeit(lambda: translate_plural(api, 'item', 'items', 3),
+                          number=NUMBER)
+    print('ngettext  direct: %.4fs  translate_plural(): %.4fs  '
+          'speedup: %.1fx' % (before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 
 import sys
+import threading
+from collections import OrderedDict
 try:
     from urllib.parse import quote
 except ImportError:
@@ -9,7 +11,8 @@ except ImportError:
 from bottle import request, html_escape
 
 __all__ = ('PY3', 'PY2', 'unicode', 'basestring', 'to_unicode', 'to_bytes',
-           'attr_escape', 'html_escape', 'full_url', 'urlquote')
+           'attr_escape', 'html_escape', 'attr_escape_bytes',
+           'html_escape_bytes', 'Markup', 'full_url', 'urlquote', 'LRUCache')
 
 ESCAPE_MAPPING = (
     ('&', '&amp;'),
@@ -24,6 +27,12 @@ HTML_ESCAPE_MAPPING = ESCAPE_MAPPING + (
     ('>', '&gt;'),
 )
 
+BYTES_ESCAPE_MAPPING = tuple((s.encode('ascii'), r.encode('ascii'))
+                             for s, r in ESCAPE_MAPPING)
+
+BYTES_HTML_ESCAPE_MAPPING = tuple((s.encode('ascii'), r.encode('ascii'))
+                                  for s, r in HTML_ESCAPE_MAPPING)
+
 #: Whether Python version is 2.x
 PY2 = sys.version_info.major == 2
 
@@ -74,6 +83,69 @@ def to_bytes(v, encoding='utf8'):
         return unicode(v).encode(encoding)
 
 
+class Markup(unicode):
+    """
+    String that contains markup which is safe to use in HTML as is. Functions
+    in this package that generate HTML return instances of this class, and
+    :py:func:`~html_escape` returns them unchanged, so fragments are not
+    escaped twice when they are nested.
+
+    The class implements the ``__html__()`` method, which is used by template
+    engines like Jinja2 and Mako (when used with MarkupSafe) to recognize
+    strings that should not be escaped.
+
+    Concatenating two ``Markup`` objects results in a ``Markup`` object.
+    Concatenating with any other string results in a plain string, since the
+    other string may not be safe::
+
+        >>> Markup('<b>') + Markup('</b>')
+        Markup('<b></b>')
+        >>> Markup('<b>') + '</b>'
+        '<b></b>'
+
+    .. note::
+        Markup that is safe in HTML content is not necessarily safe in an
+        attribute value, so :py:func:`~attr_escape` always escapes its input.
+    """
+
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+    def __add__(self, other):
+        # Lazy strings pass isinstance() checks, so the type is tested
+        if not issubclass(type(other), (unicode, bytes)):
+            # Let the other object handle it
+            return NotImplemented
+        s = unicode.__add__(self, other)
+        if isinstance(other, Markup):
+            return Markup(s)
+        return s
+
+    def __repr__(self):
+        return 'Markup(%s)' % unicode.__repr__(self)
+
+
+def escape(s, mapping):
+    """
+    Replace characters in ``s`` according to ``mapping``, which is an iterable
+    of ``(character, replacement)`` pairs. The escaping functions in this
+    module work the same way (Unicode versions inline the loop to avoid the
+    extra function call).
+
+    Each replacement is only performed if the character is present in the
+    string, so strings that do not need escaping are only scanned, and no new
+    strings are allocated for them. Membership test is considerably faster
+    than a ``replace()`` call that does not replace anything, and, in
+    CPython, also faster than ``str.translate()`` and regular expressions.
+    """
+    for c, r in mapping:
+        if c in s:
+            s = s.replace(c, r)
+    return s
+
+
 def attr_escape(attr):
     """
     Escape ``attr`` string containing HTML attribute value. This function
@@ -81,8 +153,9 @@ def attr_escape(attr):
     Functions that construct attribute values using user-supplied data should
     escape the values using this function.
     """
-    for s, r in ESCAPE_MAPPING:
-        attr = attr.replace(s, r)
+    for c, r in ESCAPE_MAPPING:
+        if c in attr:
+            attr = attr.replace(c, r)
     return attr
 
 
@@ -92,12 +165,34 @@ def html_escape(html):
     that are not desirable in HTML markup, when the source string should
     represent text content only. User-supplied data that should appar in markup
     should be escaped using this function.
+
+    :py:class:`~Markup` objects are considered safe, and are returned without
+    escaping.
     """
-    for s, r in HTML_ESCAPE_MAPPING:
-        html = html.replace(s, r)
+    if isinstance(html, Markup):
+        return html
+    for c, r in HTML_ESCAPE_MAPPING:
+        if c in html:
+            html = html.replace(c, r)
     return html
 
 
+def attr_escape_bytes(attr):
+    """
+    Bytestring version of :py:func:`~attr_escape`. The input is converted to
+    bytestring using :py:func:`~to_bytes` if necessary.
+    """
+    return escape(to_bytes(attr), BYTES_ESCAPE_MAPPING)
+
+
+def html_escape_bytes(html):
+    """
+    Bytestring version of :py:func:`~html_escape`. The input is converted to
+    bytestring using :py:func:`~to_bytes` if necessary.
+    """
+    return escape(to_bytes(html), BYTES_HTML_ESCAPE_MAPPING)
+
+
 def full_url(path='/'):
     """
     Convert a specified path to full URL based on request data. This function
@@ -123,3 +218,84 @@ def urlquote(s):
     """
     s = to_bytes(s)
     return quote(s)
+
+
+class LRUCache(object):
+    """
+    Bounded mapping that discards least recently used items. This is a simple
+    dictionary-like cache used by other modules to memoize results that are
+    expensive to compute on every request.
+
+    The ``maxsize`` argument is the maximum number of items the cache holds.
+    When a new item is added to a full cache, the item that was least recently
+    read or written is discarded.
+
+    The cache is safe to use from multiple threads::
+
+        >>> cache = LRUCache(maxsize=2)
+        >>> cache['a'] = 1
+        >>> cache['b'] = 2
+        >>> cache.get('a')
+        1
+        >>> cache['c'] = 3
+        >>> 'b' in cache
+        False
+
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the value for ``key`` and mark it as recently used. If the key
+        is not in the cache, ``default`` is returned.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def __getitem__(self, key):
+        marker = self._data
+        value = self.get(key, marker)
+        if value is marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def pop(self, key, default=None):
+        """
+        Remove ``key`` from the cache and return its value, or ``default`` if
+        the key is not in the cache.
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """
+        Remove all items from the cache.
+        """
+        with self._lock:
+            self._data.clear()
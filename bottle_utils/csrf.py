@@ -153,7 +153,8 @@ def csrf_tag():
     If the handler in which this function is invoked is not decorated with
     :py:func:`~csrf_token`, an ``AttributeError`` will be raised.
 
-    :returns:   HTML markup for hidden CSRF token field
+    :returns:   HTML markup for hidden CSRF token field as
+                :py:class:`~bottle_utils.common.Markup` object
     """
     _, token_name, _, _ = get_conf()
     token = request.csrf_token
@@ -2,8 +2,6 @@
 
 from __future__ import unicode_literals
 
-import functools
-
 try:
     from urllib import quote, unquote
 except ImportError:
@@ -14,7 +12,7 @@ from dateutil.parser import parse
 from bottle import request, MultiDict, _parse_qsl
 
 from .common import (to_bytes, to_unicode, attr_escape, html_escape,
-                     basestring, unicode)
+                     basestring, unicode, Markup, LRUCache)
 
 
 SIZES = 'KMGTP'
@@ -23,6 +21,9 @@ FERR_ONE_CLS = 'form-error'
 ERR_CLS = 'field-error'
 HTTP_PORTS = (80, 443)
 
+# URLs built by ``quoted_url()``
+URL_CACHE = LRUCache(1024)
+
 
 urlquote = lambda value: quote(to_bytes(value))
 urlunquote = lambda value: to_unicode(unquote(value))
@@ -350,6 +351,11 @@ def tag(name, content='', nonclosing=False, **attrs):
         >>> tag('span', ['a', 'b', 'c'])
         '<span>a</span><span>b</span><span>c</span>'
 
+    The content is not escaped. Escape any user-supplied content using
+    :py:func:`~bottle_utils.common.html_escape`. The return value is a
+    :py:class:`~bottle_utils.common.Markup` object, so template engines that
+    recognize it will not escape it.
+
     It does not sanitize the tag names, though, so it is possible to specify
     invalid tag names::
 
@@ -365,9 +371,9 @@ def tag(name, content='', nonclosing=False, **attrs):
     treated as a dictionary, there is no guarantee of attribute order. If
     attribute order is important, don't use this function.
 
-    This module contains a few partially applied aliases for this function.
-    These mostly have hard-wired first argument (tag name), and are all
-    uppercase:
+    This module contains a few aliases for this function. These are compiled
+    tags (see :py:func:`~compile_tag`) that have hard-wired tag name, and are
+    all uppercase:
 
     - ``A`` - alias for ``<a>`` tag
     - ``BUTTON`` - alias for ``<button>`` tag
@@ -394,26 +400,163 @@ def tag(name, content='', nonclosing=False, **attrs):
         close_tag = ''
     if not isinstance(content, basestring):
         try:
-            return ''.join(['%s%s%s' % (open_tag, to_unicode(c), close_tag)
-                            for c in content])
+            return Markup(''.join(['%s%s%s' % (open_tag, to_unicode(c),
+                                               close_tag)
+                                   for c in content]))
         except TypeError:
             pass
-    return '%s%s%s' % (open_tag, to_unicode(content), close_tag)
+    return Markup('%s%s%s' % (open_tag, to_unicode(content), close_tag))
+
+
+class CompiledTag(object):
+    """
+    Tag renderer with precomputed static attributes. Instances are created
+    using :py:func:`~compile_tag` (also available as ``tag.compile``) and
+    are called like :py:func:`~tag`, except that the tag name and static
+    attributes are not passed::
+
+        >>> option = tag.compile('option', _class='choice')
+        >>> option('one', value=1)
+        '<option class="choice" value="1">one</option>'
+
+    The opening tag up to the static attributes is rendered once when the tag
+    is compiled. On each call, only the attributes passed to the call are
+    rendered and escaped, so rendering many elements with the same static
+    attributes is little more than a string join. Attributes passed to the
+    call override the static attributes of the same name.
+
+    The output is the same as the output of :py:func:`~tag` called with
+    combined attributes, although static attributes come before the other
+    attributes. The ``nonclosing`` flag can also be passed, and if it differs
+    from the flag the tag was compiled with, the tag is rendered using
+    :py:func:`~tag`.
+    """
+
+    def __init__(self, name, nonclosing=False, **attrs):
+        self.name = name
+        self.nonclosing = bool(nonclosing)
+        self.attrs = dict((k.lstrip('_'), v) for k, v in attrs.items())
+        self.prefix = '<' + name + ''.join(
+            [' ' + attr(k, to_unicode(v)) for k, v in self.attrs.items()])
+        self.open_tag = self.prefix + '>'
+        self.close_tag = '' if nonclosing else '</%s>' % name
+
+    def __call__(self, content='', nonclosing=None, **attrs):
+        if nonclosing is not None and bool(nonclosing) != self.nonclosing:
+            return self.render(content, nonclosing, attrs)
+        if not attrs:
+            open_tag = self.open_tag
+        else:
+            open_tag = self.prefix
+            for k, v in attrs.items():
+                k = k.lstrip('_')
+                if k in self.attrs:
+                    # Overriding static attributes, so the prefix is no good
+                    return self.render(content, self.nonclosing, attrs)
+                open_tag += ' ' + attr(k, to_unicode(v))
+            open_tag += '>'
+        close_tag = self.close_tag
+        if self.nonclosing:
+            content = ''
+        elif not isinstance(content, basestring):
+            try:
+                return Markup(''.join([open_tag + to_unicode(c) + close_tag
+                                       for c in content]))
+            except TypeError:
+                pass
+        return Markup(open_tag + to_unicode(content) + close_tag)
+
+    def render(self, content, nonclosing, attrs):
+        """
+        Render the tag using :py:func:`~tag` with static attributes combined
+        with ``attrs``.
+        """
+        merged = dict(self.attrs)
+        merged.update((k.lstrip('_'), v) for k, v in attrs.items())
+        return tag(self.name, content, nonclosing, **merged)
+
+    def __repr__(self):
+        return '<CompiledTag %s>' % self.open_tag
+
+
+def compile_tag(name, nonclosing=False, **attrs):
+    """
+    Return a :py:class:`~CompiledTag` for tag ``name`` with static attributes
+    specified as keyword arguments. This function is also available as
+    ``tag.compile``. The arguments have the same meaning as the arguments of
+    the :py:func:`~tag` function.
+
+    Compiled tags are useful when rendering many elements of the same kind,
+    such as list items or options::
+
+        >>> item = tag.compile('li', _class='item')
+        >>> UL(''.join(item(label) for label in labels))
+
+    """
+    return CompiledTag(name, nonclosing, **attrs)
+
+
+tag.compile = compile_tag
 
+SPAN = CompiledTag('span')
+UL = CompiledTag('ul')
+LI = CompiledTag('li')
+P = CompiledTag('p')
+A = CompiledTag('a')
+INPUT = CompiledTag('input', nonclosing=True)
+BUTTON = CompiledTag('button')
+SUBMIT = CompiledTag('button', _type='submit')
+_HIDDEN = CompiledTag('input', nonclosing=True, _type='hidden')
+HIDDEN = lambda n, v: _HIDDEN(_name=n, value=v)
+TEXTAREA = CompiledTag('textarea')
+OPTION = CompiledTag('option')
+SELECT = CompiledTag('select')
+
+
+def itag(name, content='', nonclosing=False, **attrs):
+    """
+    Streaming version of :py:func:`~tag`. This function returns an iterator
+    that yields markup as :py:class:`~bottle_utils.common.Markup` fragments.
 
-SPAN = functools.partial(tag, 'span')
-UL = functools.partial(tag, 'ul')
-LI = functools.partial(tag, 'li')
-P = functools.partial(tag, 'p')
-A = functools.partial(tag, 'a')
-INPUT = functools.partial(tag, 'input', nonclosing=True)
-BUTTON = functools.partial(tag, 'button')
-SUBMIT = functools.partial(BUTTON, _type='submit')
-HIDDEN = lambda n, v: INPUT(_name=n, value=v, _type='hidden')
-TEXTAREA = functools.partial(tag, 'textarea')
-BUTTON = functools.partial(tag, 'button')
-OPTION = functools.partial(tag, 'option')
-SELECT = functools.partial(tag, 'select')
+    If ``content`` is an iterable, a tag is yielded for each member as it is
+    consumed. Otherwise, a single tag is yielded::
+
+        >>> list(itag('li', ['a', 'b']))
+        ['<li>a</li>', '<li>b</li>']
+
+    The opening tag is rendered only once, regardless of the number of
+    members.
+    """
+    compiled = CompiledTag(name, nonclosing, **attrs)
+    if isinstance(content, basestring):
+        yield compiled(content)
+        return
+    try:
+        content = iter(content)
+    except TypeError:
+        yield compiled(content)
+        return
+    for c in content:
+        yield compiled(c)
+
+
+def iwrap(name, fragments, **attrs):
+    """
+    Return an iterator that yields the opening tag, each of the
+    ``fragments``, and the closing tag. This is used to wrap streamed content
+    in a single tag, such as list items yielded by :py:func:`~itag` in an
+    unordered list::
+
+        >>> list(iwrap('ul', itag('li', ['a', 'b'])))
+        ['<ul>', '<li>a</li>', '<li>b</li>', '</ul>']
+
+    The fragments are not escaped.
+    """
+    compiled = CompiledTag(name, **attrs)
+    yield Markup(compiled.open_tag)
+    for fragment in fragments:
+        yield to_unicode(fragment)
+    yield Markup(compiled.close_tag)
 
 
 def vinput(name, values, **attrs):
@@ -472,7 +615,39 @@ def varea(name, values, **attrs):
     return TEXTAREA(value, _name=name, **attrs)
 
 
-def vcheckbox(name, value, values, default=False, **attrs):
+def selected_values(name, values):
+    """
+    Return a frozen set of values bound to ``name`` in ``values``, converted
+    to Unicode strings. This set is used to check whether checkboxes and
+    options are selected using a single lookup.
+
+    If ``values`` supports ``getall()`` (e.g., ``bottle.MultiDict``), all
+    values for the name are included. Otherwise, the value may be a single
+    value or a list of values. ::
+
+        >>> selected_values('foo', {'foo': [1, 2]})
+        frozenset({'1', '2'})
+
+    The set is not cached, so when many checkboxes or options are bound to
+    the same name, it can be calculated once and passed to
+    :py:func:`~vcheckbox` or :py:func:`~vselect` using the ``selection``
+    argument.
+    """
+    try:
+        selected = values.getall(name)
+    except AttributeError:
+        selected = values.get(name, [])
+    if isinstance(selected, basestring):
+        selected = [selected]
+    else:
+        try:
+            selected = iter(selected)
+        except TypeError:
+            selected = [selected]
+    return frozenset(unicode(v) for v in selected)
+
+
+def vcheckbox(name, value, values, default=False, selection=None, **attrs):
     """
     Render checkbox with bound value. This function renders a checkbox which is
     checked or unchecked depending on whether its own name-value combination
@@ -514,17 +689,21 @@ def vcheckbox(name, value, values, default=False, **attrs):
         >>> vcheckbox('foo', 'bar', {}, default=True)
         '<input type="checkbox" name="foo" id="foo" value="bar" checked>'
 
+    The values are looked up using :py:func:`~selected_values`. When many
+    checkboxes are bound to the same name, the set of selected values (as
+    Unicode strings) can be calculated once and passed directly using the
+    ``selection`` argument, in which case ``values`` are not used::
+
+        selection = selected_values('foo', values)
+        boxes = [vcheckbox('foo', v, values, selection=selection)
+                 for v in choices]
+
     """
     attrs.setdefault('_id', name)
-    if name in values:
-        try:
-            values = values.getall(name)
-        except AttributeError:
-            values = values.get(name, [])
-        if isinstance(values, basestring):
-            if unicode(value) == unicode(values):
-                attrs['checked'] = None
-        elif unicode(value) in [unicode(v) for v in values]:
+    if selection is None and name in values:
+        selection = selected_values(name, values)
+    if selection is not None:
+        if unicode(value) in selection:
             attrs['checked'] = None
     elif default:
         if default:
@@ -534,7 +713,7 @@ def vcheckbox(name, value, values, default=False, **attrs):
     return INPUT(_type='checkbox', _name=name, value=value, **attrs)
 
 
-def vselect(name, choices, values, empty=None, **attrs):
+def vselect(name, choices, values, empty=None, selection=None, **attrs):
     """
     Render select list with bound value. This function renders the select list
     with option elements with appropriate element selected based on field
@@ -567,18 +746,73 @@ def vselect(name, choices, values, empty=None, **attrs):
     argument for ``empty`` should be a label, and the matching value is
     ``None``. The emtpy value is always inseted at the beginning of the list.
 
+    If the ``multiple`` attribute is specified (e.g., ``multiple=None``), all
+    values for the name are selected, as returned by
+    :py:func:`~selected_values`. A set of selected values (as Unicode
+    strings) can also be passed directly using the ``selection`` argument.
+
     """
     attrs.setdefault('_id', name)
-    value = values.get(name)
-    options = []
+    if selection is None:
+        selection = get_selection(name, values, is_multiple(attrs))
+    options = iter_options(choices, selection, empty)
+    return SELECT(''.join(options), _name=name, **attrs)
+
+
+def is_multiple(attrs):
+    """
+    Return whether tag attributes include the ``multiple`` attribute.
+    """
+    return 'multiple' in attrs or '_multiple' in attrs
+
+
+def get_selection(name, values, multiple=False):
+    """
+    Return the set of selected values for a select list. For lists that allow
+    multiple selection, this is the return value of
+    :py:func:`~selected_values`. Otherwise, it is a set containing only the
+    value returned by ``values.get(name)``.
+    """
+    if multiple:
+        return selected_values(name, values)
+    return frozenset([unicode(values.get(name))])
+
+
+def iter_options(choices, selection, empty=None):
+    """
+    Return an iterator that yields option elements for the ``choices``
+    iterable of ``(value, label)`` two-tuples. Options whose values (as
+    Unicode strings) are in the ``selection`` set are selected. If ``empty``
+    label is specified, an option without value is yielded first.
+
+    This function is used by :py:func:`~vselect` and :py:func:`~ivselect`.
+    """
+    if empty:
+        yield OPTION(empty, value=None)
     for val, label in choices:
-        if unicode(val) == unicode(value):
-            options.append(OPTION(label, value=val, selected=None))
+        if unicode(val) in selection:
+            yield OPTION(label, value=val, selected=None)
         else:
-            options.append(OPTION(label, value=val))
-    if empty:
-        options.insert(0, OPTION(empty, value=None))
-    return SELECT(''.join(options), _name=name, **attrs)
+            yield OPTION(label, value=val)
+
+
+def ivselect(name, choices, values, empty=None, selection=None, **attrs):
+    """
+    Streaming version of :py:func:`~vselect`. Instead of a string, this
+    function returns an iterator that yields the opening select tag, one
+    option element at a time, and the closing select tag.
+
+    Options are rendered as the ``choices`` iterable is consumed, so choices
+    can be a generator (e.g., a database cursor), and the complete markup is
+    never held in memory. The iterator can be returned from a route handler
+    as a streaming response, or fed to a template engine that supports
+    streaming.
+    """
+    attrs.setdefault('_id', name)
+    if selection is None:
+        selection = get_selection(name, values, is_multiple(attrs))
+    options = iter_options(choices, selection, empty)
+    return iwrap('select', options, _name=name, **attrs)
 
 
 def form(method=None, action=None, csrf=False, multipart=False, **attrs):
@@ -687,9 +921,44 @@ def quote_dict(mapping):
     return qdict
 
 
+def url_cache_key(route, params):
+    """
+    Return the :py:data:`URL_CACHE` key for URL built from ``route`` and
+    ``params``, or ``None`` if the URL cannot be cached (e.g., because some of
+    the parameters are lists).
+
+    The key includes the application, the number of its routes, and the
+    ``SCRIPT_NAME``, so URLs are built again after routes are added, and
+    applications mounted under different paths do not share URLs. To
+    invalidate the cache in other cases (e.g., when routes are replaced),
+    call ``URL_CACHE.clear()``.
+    """
+    app = request.app
+    try:
+        key = (app, len(app.routes), request.environ.get('SCRIPT_NAME', ''),
+               route, frozenset((k, type(v), v) for k, v in params.items()))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
 def quoted_url(route, **params):
-    """Return matching URL with it's query parameters quoted."""
-    return request.app.get_url(route, **quote_dict(params))
+    """
+    Return matching URL with it's query parameters quoted.
+
+    The URLs are cached (see :py:func:`~url_cache_key`), so building the same
+    URL repeatedly (e.g., in navigation menus) is a dict lookup.
+    """
+    key = url_cache_key(route, params)
+    if key is not None:
+        url = URL_CACHE.get(key)
+        if url is not None:
+            return url
+    url = request.app.get_url(route, **quote_dict(params))
+    if key is not None:
+        URL_CACHE[key] = url
+    return url
 
 
 def full_url(path='', with_scheme=False):
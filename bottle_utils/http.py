@@ -7,13 +7,20 @@
 
 from __future__ import unicode_literals
 
+import io
 import os
+import stat
 import time
+import zlib
+import uuid
+import hashlib
 import functools
 
 from bottle import (HTTPResponse, HTTPError, parse_date, parse_range_header,
                     request, response)
 
+from .common import LRUCache, to_bytes
+
 MIME_TYPES = {
     # Text/Code
     'txt': 'text/plain',
@@ -58,6 +65,21 @@ EXTENSIONS = list(MIME_TYPES.keys())
 DEFAULT_TYPE = MIME_TYPES['txt']
 TIMESTAMP_FMT = '%a, %d %b %Y %H:%M:%S GMT'
 
+#: Content hashes calculated by :py:func:`~content_etag`
+ETAG_CACHE = LRUCache(maxsize=1024)
+
+#: Content types other than ``text/*`` that are compressed on the fly
+COMPRESSIBLE_TYPES = ('application/json',)
+
+#: Pre-compressed file suffixes in order of preference
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+#: Compressed content produced by :py:func:`~gzip_cached`
+COMPRESS_CACHE = LRUCache(maxsize=128)
+
+#: Content larger than this many bytes is compressed without caching
+COMPRESS_CACHE_MAX_SIZE = 256 * 1024
+
 
 def no_cache(func):
     """
@@ -99,6 +121,236 @@ def format_ts(seconds=None):
     return time.strftime(TIMESTAMP_FMT, time.gmtime(seconds))
 
 
+def make_etag(size, timestamp):
+    """
+    Return a strong entity tag calculated from content size and modification
+    timestamp. The timestamp is used with microsecond precision, so content
+    that is modified more than once per second still gets a new tag.
+
+    This is cheap as it does not look at the content itself, but it assumes
+    that the content does not change without the timestamp or size changing.
+    See :py:func:`~content_etag` for an alternative.
+    """
+    return '"%x-%x"' % (int(timestamp * 1000000), size)
+
+
+def content_etag(content, filename, size, timestamp, hashfunc=hashlib.sha1,
+                 chunksize=1024*1024):
+    """
+    Return a strong entity tag calculated by hashing the content. This
+    function can be passed as ``etag`` argument to :py:func:`~send_file`.
+
+    The ``content`` must support ``tell()`` and ``seek()``, as it is read from
+    the current position to the end, and then rewound to that position. If it
+    does not, ``None`` is returned and no entity tag is used.
+
+    Hashing the content is expensive, so the results are cached in
+    :py:data:`~ETAG_CACHE` using ``filename``, ``size`` and ``timestamp`` as
+    the key. Content whose ``size`` or ``timestamp`` is not known (``None``)
+    is hashed every time, as the key cannot tell different content apart. The
+    hash function can be customized using the ``hashfunc`` argument, which
+    should be a constructor from ``hashlib`` or compatible::
+
+        send_file(f, path, size, timestamp,
+                  etag=functools.partial(content_etag, hashfunc=hashlib.md5))
+
+    """
+    cacheable = size is not None and timestamp is not None
+    key = (filename, size, timestamp, hashfunc)
+    if cacheable:
+        etag = ETAG_CACHE.get(key)
+        if etag is not None:
+            return etag
+    try:
+        pos = content.tell()
+    except (AttributeError, io.UnsupportedOperation, OSError, IOError):
+        return None
+    checksum = hashfunc()
+    for chunk in iter(lambda: content.read(chunksize), b''):
+        checksum.update(chunk)
+    content.seek(pos)
+    etag = '"%s"' % checksum.hexdigest()
+    if cacheable:
+        ETAG_CACHE[key] = etag
+    return etag
+
+
+def etag_matches(etag, header):
+    """
+    Return whether ``etag`` matches any of the entity tags listed in an
+    ``If-None-Match`` request header. The tags are compared using the weak
+    comparison, which means that the ``W/`` prefix is ignored. The ``*``
+    header value matches any entity tag.
+    """
+    if header.strip() == '*':
+        return True
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def range_is_current(if_range, etag, timestamp):
+    """
+    Return whether the ``If-Range`` request header value permits serving a
+    partial response. The header can either be an entity tag, which must
+    match ``etag`` using the strong comparison, or a date, which must match
+    the ``timestamp`` exactly (at one second precision, as sent in the
+    ``Last-Modified`` header). A missing header always permits ranges.
+    """
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return (bool(etag) and not if_range.startswith('W/') and
+                if_range == etag)
+    date = parse_date(if_range.strip())
+    return bool(timestamp) and date is not None and date == int(timestamp)
+
+
+def parse_accept_encoding(header):
+    """
+    Parse ``Accept-Encoding`` header value into a dict that maps content
+    codings to their quality values. Codings without explicit quality value
+    have the quality of 1. ::
+
+        >>> parse_accept_encoding('gzip, br;q=0.5, *;q=0')
+        {'gzip': 1.0, 'br': 0.5, '*': 0.0}
+
+    """
+    qualities = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+
+def negotiate_encoding(header, available):
+    """
+    Select the best content coding from ``available`` codings based on the
+    ``Accept-Encoding`` header value. The ``available`` codings should be
+    listed in order of server preference, which is used when client gives
+    the same quality to several codings.
+
+    Returns ``None`` if none of the codings is acceptable or the header is
+    empty, in which case content should be sent without encoding.
+    """
+    if not header:
+        return None
+    qualities = parse_accept_encoding(header)
+    default = qualities.get('*', 0)
+    best = None
+    best_quality = 0
+    for coding in available:
+        quality = qualities.get(coding, default)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def is_compressible(ctype):
+    """
+    Return whether content of the ``ctype`` content type should be compressed
+    on the fly. These are ``text/*`` types and types listed in
+    :py:data:`~COMPRESSIBLE_TYPES`.
+    """
+    ctype = ctype.split(';')[0]
+    return ctype.startswith('text/') or ctype in COMPRESSIBLE_TYPES
+
+
+def find_precompressed(path, accept_encoding=None, isfile=os.path.isfile):
+    """
+    Find a pre-compressed sibling of the file at ``path`` that is acceptable
+    according to ``accept_encoding`` header value (the header in the current
+    request by default). The siblings are files with the suffixes listed in
+    :py:data:`~PRECOMPRESSED` (e.g., 'foo.css.br' or 'foo.css.gz').
+
+    Returns a ``(path, encoding)`` tuple. If an acceptable sibling is found,
+    its path and content coding are returned. If siblings exist but none of
+    them is acceptable, the original path is returned with ``'identity'``
+    coding. Otherwise, the original path is returned with ``None``. The
+    returned encoding can be passed to :py:func:`~send_file`.
+
+    The ``isfile`` argument is the function used to test whether the siblings
+    exist. It defaults to ``os.path.isfile()``.
+    """
+    if accept_encoding is None:
+        accept_encoding = request.environ.get('HTTP_ACCEPT_ENCODING', '')
+    found = [(coding, path + suffix) for coding, suffix in PRECOMPRESSED
+             if isfile(path + suffix)]
+    if not found:
+        return path, None
+    coding = negotiate_encoding(accept_encoding, [c for c, _ in found])
+    if coding is None:
+        return path, 'identity'
+    return dict(found)[coding], coding
+
+
+def iter_gzip(fd, level=6, chunksize=64*1024):
+    """
+    Return an iterator that yields gzip-compressed content of ``fd`` file-like
+    object. The content is read and compressed in chunks of ``chunksize``
+    bytes, so memory use does not depend on the size of the content. The
+    ``fd`` object is closed when the iterator is exhausted or closed.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        while True:
+            chunk = fd.read(chunksize)
+            if not chunk:
+                break
+            chunk = compressor.compress(to_bytes(chunk))
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+    finally:
+        close_content(fd)
+
+
+def gzip_cached(fd, filename, size, timestamp, level=6):
+    """
+    Return gzip-compressed content of ``fd`` as a bytestring. The result is
+    cached in :py:data:`~COMPRESS_CACHE` using ``filename``, ``size`` and
+    ``timestamp`` as the key, so a new version of the content is compressed
+    again once its timestamp changes.
+
+    The ``fd`` object is closed after it is compressed. It can also be a
+    function that returns the file-like object, in which case it is only
+    called when the content is not cached.
+    """
+    key = (filename, size, timestamp, level)
+    data = COMPRESS_CACHE.get(key)
+    if data is None:
+        if callable(fd):
+            fd = fd()
+        data = COMPRESS_CACHE[key] = b''.join(iter_gzip(fd, level))
+    return data
+
+
+def close_content(content):
+    """
+    Close ``content`` if it is a file-like object that has a ``close()``
+    method. This is used when content is not going to be passed to Bottle,
+    which would otherwise close it once the response is sent.
+    """
+    close = getattr(content, 'close', None)
+    if close is not None:
+        close()
+
+
 def iter_read_range(fd, offset, length, chunksize=1024*1024):
     """
     Return an iterator that allows reading files in chunks. The ``fd`` should
@@ -128,12 +380,136 @@ def iter_read_range(fd, offset, length, chunksize=1024*1024):
         yield chunk
 
 
-def send_file(content, filename, size=None, timestamp=None):
+def coalesce_ranges(ranges):
+    """
+    Sort byte ranges by offset and merge the ones that overlap or are adjacent
+    to each other. The ``ranges`` argument is an iterable of ``(start, end)``
+    tuples where ``end`` is not inclusive, such as the ones returned by
+    ``bottle.parse_range_header()``.
+
+    Returns a list of ``(start, end)`` tuples. Example::
+
+        >>> coalesce_ranges([(10, 20), (0, 5), (5, 8), (15, 30)])
+        [(0, 8), (10, 30)]
+
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def multipart_headers(ranges, size, ctype, boundary):
+    """
+    Return a list of part headers for a ``multipart/byteranges`` response, one
+    for each of the ``(start, end)`` tuples in ``ranges``. The headers are
+    bytestrings that include the boundary delimiter and the blank line that
+    separates the part headers from the part body.
+    """
+    tpl = '--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+    return [(tpl % (boundary, ctype, start, end - 1, size)).encode('latin1')
+            for start, end in ranges]
+
+
+def iter_read_ranges(fd, ranges, part_headers, boundary,
+                     chunksize=1024*1024):
+    """
+    Return an iterator that yields the body of a ``multipart/byteranges``
+    response. The ``ranges`` must be sorted and must not overlap (see
+    :py:func:`~coalesce_ranges`), and ``part_headers`` are the matching
+    headers returned by :py:func:`~multipart_headers`.
+
+    All ranges are read from the single ``fd`` object in one forward pass. If
+    the object does not support ``seek()``, the data between the ranges is
+    read and discarded, so ``fd`` is expected to be positioned at the start of
+    the content in that case.
+    """
+    pos = 0
+    for (start, end), part_header in zip(ranges, part_headers):
+        yield part_header
+        try:
+            fd.seek(start)
+            pos = start
+        except AttributeError:
+            while pos < start:
+                skipped = fd.read(min(start - pos, chunksize))
+                if not skipped:
+                    break
+                pos += len(skipped)
+        while pos < end:
+            chunk = fd.read(min(end - pos, chunksize))
+            if not chunk:
+                break
+            pos += len(chunk)
+            yield chunk
+        yield b'\r\n'
+    yield ('--%s--\r\n' % boundary).encode('latin1')
+
+
+def get_fileno(fd):
+    """
+    Return the file descriptor number of ``fd`` or ``None`` if ``fd`` is not
+    backed by a real file. Objects like ``StringIO`` either lack the
+    ``fileno()`` method or raise when it is called, and are treated as not
+    being file-backed.
+    """
+    try:
+        return fd.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+class FileRange(object):
+    """
+    File-like object representing a byte range within a file-backed object.
+    Reads from this object never go past the end of the range.
+
+    The ``fd`` object is positioned at ``offset`` when the range object is
+    created. Because the range object exposes the ``fileno()`` method of the
+    underlying file, and it is positioned at the start of the range, WSGI
+    servers whose ``wsgi.file_wrapper`` implementation uses ``sendfile()``
+    (e.g., gunicorn, uWSGI) can transmit the range without copying it through
+    userspace. Servers that do not use ``sendfile()`` simply call ``read()``
+    on this object, which returns no more than ``length`` bytes in total.
+
+    Closing the range object also closes the underlying file.
+    """
+
+    def __init__(self, fd, offset, length):
+        self.fd = fd
+        self.remaining = length
+        fd.seek(offset)
+
+    def fileno(self):
+        return self.fd.fileno()
+
+    def tell(self):
+        return self.fd.tell()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if not size:
+            return b''
+        chunk = self.fd.read(size)
+        self.remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self.fd.close()
+
+
+def send_file(content, filename, size=None, timestamp=None, etag=None,
+              encoding=None, compress=False):
     """
     Convert file data into an HTTP response.
 
     This method is used when the file data does not exist on disk, such as when
-    it is dynamically generated.
+    it is dynamically generated. It can also be used with regular files opened
+    in binary mode.
 
     Because the file does not exist on disk, the basic metadata which is
     usually read from the file itself must be supplied as arguments. The
@@ -144,13 +520,59 @@ def send_file(content, filename, size=None, timestamp=None):
     The ``size`` argument is the payload size in bytes. For streaming files,
     this can be particularly important as the ranges are calculated baed on
     content length. If ``size`` is omitted, then support for ranges is not
-    advertise and ranges are never returned.
+    advertise and ranges are never returned. When multiple ranges are
+    requested, overlapping and adjacent ranges are merged, and the remaining
+    ranges are returned as a single ``multipart/byteranges`` response which is
+    read from ``content`` in one pass.
 
     ``timestamp`` is expected to be in seconds since UNIX epoch, and is used to
     calculate Last-Modified HTTP headers, as well as handle If-Modified-Since
     header. If omitted, current time is used, and If-Modified-Since is never
     checked.
 
+    The ``etag`` argument is the entity tag of the content. By default, the
+    entity tag is calculated from ``size`` and ``timestamp`` using
+    :py:func:`~make_etag` if both are known. Pass a string to use a tag that
+    has already been calculated, ``False`` to disable entity tags, or a
+    function like :py:func:`~content_etag` that takes content, filename, size
+    and timestamp, and returns the entity tag. The tag is used to handle the
+    If-None-Match header (instead of If-Modified-Since) and the If-Range
+    header. When the If-Range header does not match, the Range header is
+    ignored and the full content is returned.
+
+    If ``content`` is already compressed, its content coding (e.g., 'gzip' or
+    'br') should be passed as ``encoding`` argument, and it is used as
+    Content-Encoding header. The return value of
+    :py:func:`~find_precompressed` can be used for this. Passing 'identity'
+    means the content is not compressed, but compressed variants exist, so it
+    can still be compressed on the fly when ``compress`` is ``True``.
+
+    If ``compress`` is ``True``, content of ``text/*`` types and types listed
+    in :py:data:`~COMPRESSIBLE_TYPES` is gzip-compressed on the fly for
+    clients that accept it. Content that is no larger than
+    :py:data:`~COMPRESS_CACHE_MAX_SIZE` and has known size and timestamp is
+    compressed in full and cached using :py:func:`~gzip_cached`, so it keeps
+    the Content-Length header and range support. Because the cache key is
+    based on ``filename``, it should uniquely identify the content when
+    compression is used. Larger content is compressed while it is being sent,
+    without Content-Length and range support.
+
+    Whenever compression is involved, the entity tag gets the content coding
+    as suffix, and a ``Vary: Accept-Encoding`` header is added.
+
+    The ``content`` can also be a function that takes no arguments and returns
+    the file-like object. It is only called when the content is needed, so
+    responses to conditional and HEAD requests, and responses that use
+    cached compressed content, do not open the file. File-like objects that
+    are not used in the response are closed.
+
+    When ``content`` is backed by a real file (it has a working ``fileno()``
+    method), the file object is handed to Bottle as is, and range responses
+    use a :py:class:`~FileRange` object. Bottle passes file-like objects to the
+    server's ``wsgi.file_wrapper``, so servers that support it can use
+    ``sendfile()`` instead of copying the data through Python. Other objects,
+    such as ``StringIO``, are read in chunks using :py:func:`~iter_read_range`.
+
     .. note::
         The returned response is a completely new response object.
         Modifying the reponse object in the current request context is not
@@ -177,33 +599,231 @@ def send_file(content, filename, size=None, timestamp=None):
 
     # Set basic headers
     headers['Content-Type'] = ctype
-    if size:
-        headers['Content-Length'] = size
     headers['Last-Modified'] = format_ts(timestamp)
 
-    # Check if If-Modified-Since header is in request and respond early if so
-    if timestamp:
+    opener = None
+    if callable(content):
+        opener, content = content, None
+
+    if callable(etag):
+        if opener:
+            content, opener = opener(), None
+        etag = etag(content, filename, size, timestamp)
+    elif etag is None and size is not None and timestamp:
+        etag = make_etag(size, timestamp)
+
+    gzip = False
+    if compress and encoding in (None, 'identity') and is_compressible(ctype):
+        encoding = 'identity'
+        accept = request.environ.get('HTTP_ACCEPT_ENCODING')
+        if negotiate_encoding(accept, ['gzip']):
+            encoding = 'gzip'
+            gzip = True
+    if encoding:
+        headers['Vary'] = 'Accept-Encoding'
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+            if etag and etag.endswith('"'):
+                etag = '%s-%s"' % (etag[:-1], encoding)
+    if etag:
+        headers['ETag'] = etag
+
+    # Check if If-None-Match or If-Modified-Since header is in request and
+    # respond early if so. If-Modified-Since is ignored when If-None-Match is
+    # present (RFC 7232, section 3.3).
+    nonematch = request.environ.get('HTTP_IF_NONE_MATCH')
+    if nonematch:
+        if etag and etag_matches(etag, nonematch):
+            headers['Date'] = format_ts()
+            close_content(content)
+            return HTTPResponse(status=304, **headers)
+    elif timestamp:
         modsince = request.environ.get('HTTP_IF_MODIFIED_SINCE')
         modsince = modsince and parse_date(modsince.split(';')[0].strip())
-        if modsince is not None and modsince >= timestamp:
+        # Last-Modified has one second precision, so we compare to that
+        if modsince is not None and modsince >= int(timestamp):
             headers['Date'] = format_ts()
+            close_content(content)
             return HTTPResponse(status=304, **headers)
 
+    cacheable = (size is not None and timestamp and
+                 size <= COMPRESS_CACHE_MAX_SIZE)
+    if gzip and cacheable:
+        data = gzip_cached(opener or content, filename, size, timestamp)
+        close_content(content)
+        content, opener = io.BytesIO(data), None
+        size = len(data)
+    elif gzip:
+        content = iter_gzip(opener() if opener else content)
+        opener = None
+        size = None
+
+    if size:
+        headers['Content-Length'] = size
+
     if request.method == 'HEAD':
         # Request is a HEAD, so remove any content body
-        content = ''
+        close_content(content)
+        content, opener = '', None
+    elif opener:
+        content = opener()
 
     if size:
         headers['Accept-Ranges'] = 'bytes'
 
     ranges = request.environ.get('HTTP_RANGE')
-    if ranges and size:
-        ranges = list(parse_range_header(ranges, size))
+    if_range = request.environ.get('HTTP_IF_RANGE')
+    if ranges and size and range_is_current(if_range, etag, timestamp):
+        ranges = coalesce_ranges(parse_range_header(ranges, size))
         if not ranges:
+            close_content(content)
             return HTTPError(416, "Request Range Not Satisfiable")
+        if len(ranges) > 1:
+            boundary = uuid.uuid4().hex
+            part_headers = multipart_headers(ranges, size, ctype, boundary)
+            headers['Content-Type'] = ('multipart/byteranges; boundary=%s' %
+                                       boundary)
+            # Part headers, part bodies, CRLF after each part body, and the
+            # closing delimiter
+            headers['Content-Length'] = str(
+                sum(len(h) for h in part_headers) +
+                sum(end - start + 2 for start, end in ranges) +
+                len(boundary) + 6)
+            if content:
+                content = iter_read_ranges(content, ranges, part_headers,
+                                           boundary)
+            return HTTPResponse(content, status=206, **headers)
         start, end = ranges[0]
         headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end - 1, size)
         headers['Content-Length'] = str(end - start)
-        content = iter_read_range(content, start, end - start)
+        if get_fileno(content) is not None:
+            content = FileRange(content, start, end - start)
+        elif content:
+            # Content is empty for HEAD requests, so there is nothing to read
+            content = iter_read_range(content, start, end - start)
+        return HTTPResponse(content, status=206, **headers)
     return HTTPResponse(content, **headers)
 
+
+class StaticFiles(object):
+    """
+    Route callback that serves files from the ``root`` directory using
+    :py:func:`~send_file`. It is a counterpart to ``bottle.static_file`` that
+    avoids repeating system calls for frequently requested files.
+
+    Use an instance as callback for a route with a ``path`` wildcard::
+
+        app.route('/static/<path:path>', callback=StaticFiles('/srv/static'))
+
+    Requested paths are resolved relative to ``root``. Paths that resolve to
+    a location outside of ``root`` result in a 403 response, and missing files
+    result in a 404 response.
+
+    Results of ``os.stat()`` calls, including missing files, are cached in a
+    LRU cache holding at most ``maxsize`` paths. Cached results are reused for
+    ``ttl`` seconds, after which the file is checked again, so changes on
+    disk are picked up without any filesystem notification mechanism.
+
+    Contents of files that are no larger than ``max_cached_size`` bytes are
+    read once and kept in another LRU cache of ``maxsize`` items, and they are
+    read again only when the size or modification time of the file changes.
+    Larger files are opened on each request, and are passed to the server's
+    ``wsgi.file_wrapper`` as file objects, so that they can be transmitted
+    using ``sendfile()``. Open file objects are not shared between requests,
+    because their file position is used by concurrent requests and
+    ``sendfile()``.
+
+    If ``precompressed`` is ``True`` (default), acceptable pre-compressed
+    siblings of the requested file are served instead of the file (see
+    :py:func:`~find_precompressed`). If ``compress`` is ``True``, text files
+    are compressed on the fly (see :py:func:`~send_file`).
+    """
+
+    def __init__(self, root, maxsize=1024, ttl=5, max_cached_size=64*1024,
+                 precompressed=True, compress=False):
+        self.root = os.path.join(os.path.abspath(root), '')
+        self.ttl = ttl
+        self.max_cached_size = max_cached_size
+        self.precompressed = precompressed
+        self.compress = compress
+        # Maps paths to ``(check_time, stat_result)`` tuples. The stat result
+        # is ``None`` for paths that do not exist.
+        self.stat_cache = LRUCache(maxsize)
+        # Maps paths to ``(mtime, size, data)`` tuples.
+        self.data_cache = LRUCache(maxsize)
+
+    def resolve(self, path):
+        """
+        Return absolute path of the requested ``path`` or ``None`` if it is
+        outside of the root directory.
+        """
+        path = os.path.abspath(os.path.join(self.root, path.strip('/\\')))
+        if not path.startswith(self.root):
+            return None
+        return path
+
+    def stat(self, path):
+        """
+        Return the result of ``os.stat()`` call for ``path``, or ``None`` if
+        the path does not exist. Results are cached for ``ttl`` seconds.
+        """
+        now = time.time()
+        cached = self.stat_cache.get(path)
+        if cached and now - cached[0] < self.ttl:
+            return cached[1]
+        try:
+            result = os.stat(path)
+        except OSError:
+            result = None
+        self.stat_cache[path] = (now, result)
+        return result
+
+    def isfile(self, path):
+        """
+        Return whether ``path`` is a regular file using cached stat results.
+        """
+        result = self.stat(path)
+        return result is not None and stat.S_ISREG(result.st_mode)
+
+    def open(self, path, result):
+        """
+        Return a file-like object for ``path`` whose stat result is
+        ``result``. Contents of small files are served from memory.
+        """
+        if result.st_size > self.max_cached_size:
+            return open(path, 'rb')
+        cached = self.data_cache.get(path)
+        if cached and cached[:2] == (result.st_mtime, result.st_size):
+            return io.BytesIO(cached[2])
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.data_cache[path] = (result.st_mtime, result.st_size, data)
+        return io.BytesIO(data)
+
+    def __call__(self, path):
+        fullpath = self.resolve(path)
+        if fullpath is None:
+            return HTTPError(403, "Access denied.")
+        result = self.stat(fullpath)
+        if result is None or not stat.S_ISREG(result.st_mode):
+            return HTTPError(404, "File does not exist.")
+        filename, encoding = fullpath, None
+        if self.precompressed:
+            fullpath, encoding = find_precompressed(fullpath,
+                                                    isfile=self.isfile)
+            if fullpath != filename:
+                result = self.stat(fullpath)
+                if result is None:
+                    # Stat result of the sibling expired since it was found,
+                    # and it is now missing
+                    return HTTPError(404, "File does not exist.")
+        # The file is only opened if the response needs its content
+        content = functools.partial(self.open, fullpath, result)
+        try:
+            return send_file(content, filename, size=result.st_size,
+                             timestamp=result.st_mtime, encoding=encoding,
+                             compress=self.compress)
+        except (IOError, OSError):
+            # File was removed or became unreadable since it was checked
+            self.stat_cache.pop(fullpath)
+            return HTTPError(404, "File does not exist.")
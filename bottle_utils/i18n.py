@@ -1,22 +1,49 @@
+import os
+import time
+import pickle
+import struct
 import gettext
 import functools
 
 from warnings import warn
 
+import bottle
 from bottle import (redirect,
                     request,
+                    HTTPResponse,
                     response,
                     template,
                     BaseTemplate,
                     DictMixin)
 
-from .lazy import lazy
+from .lazy import lazy, batch_resolver
 from .html import quoted_url
-from .common import to_unicode
+from .common import LRUCache, to_unicode
 
 
 CONTEXT_SEPARATOR = '\x04'
 
+# Prefix of request environment keys that hold request attributes. Setting
+# these keys is the same as setting the attributes, but it skips the check for
+# an existing attribute, which raises and catches an exception each time.
+REQUEST_EXT = 'bottle.request.ext.'
+
+# Maximum number of translations cached for each translation object, for
+# singular and plural messages each (see ``cache_translation()``)
+TRANSLATION_CACHE_SIZE = 4096
+
+# Localized template names, keyed by base template name and locale
+TEMPLATE_CACHE = {}
+
+# Parsed ``Accept-Language`` header values
+ACCEPT_LANGUAGE_CACHE = LRUCache(256)
+
+# Header of a compiled catalog file, containing the size of the index
+CATALOG_HEADER = struct.Struct(str('<I'))
+
+# Translations used for routes that are excepted from the i18n plugin
+NULL_TRANSLATIONS = gettext.NullTranslations()
+
 
 def dummy_gettext(message):
     """
@@ -63,6 +90,75 @@ def dummy_npgettext(context, singular, plural, n):
     return dummy_ngettext(singular, plural, n)
 
 
+def translation_cache(api, name='_translation_cache'):
+    """
+    Return the dict that caches translations for the ``api`` translation
+    object. The dict is stored on the object itself under ``name``, so it is
+    discarded together with the object (e.g., when translations are
+    reloaded).
+
+    Only ``gettext.NullTranslations`` instances (including
+    ``gettext.GNUTranslations``) are cached. Other objects, like the
+    ``gettext`` module, get a new dict each time, because their translations
+    depend on global state.
+    """
+    if not isinstance(api, gettext.NullTranslations):
+        return {}
+    return api.__dict__.setdefault(name, {})
+
+
+def cache_translation(cache, key, result):
+    """
+    Store ``result`` under ``key`` in a dict returned by
+    :py:func:`~translation_cache`. When the dict holds
+    :py:data:`~TRANSLATION_CACHE_SIZE` results, it is cleared first, so
+    translations that are still in use are cached again, and there is no
+    bookkeeping when cached results are used.
+    """
+    if len(cache) >= TRANSLATION_CACHE_SIZE:
+        cache.clear()
+    cache[key] = result
+
+
+def translate(api, message):
+    """
+    Translate ``message`` using the ``api`` translation object, and return
+    the result as unicode string.
+
+    Results are cached in a dict stored on the translation object (see
+    :py:func:`~translation_cache`), so frequently used messages only need to
+    be translated once for each locale.
+    """
+    try:
+        return api.__dict__['_translation_cache'][message]
+    except (AttributeError, KeyError):
+        pass
+    result = to_unicode(api.gettext(message))
+    cache_translation(translation_cache(api), message, result)
+    return result
+
+
+def translate_plural(api, singular, plural, n):
+    """
+    Translate ``singular`` or ``plural`` message for count ``n`` using the
+    ``api`` translation object, and return the result as unicode string.
+
+    Results are cached the same way as for :py:func:`~translate`, but in a
+    separate dict. Counts are part of the cache key, because calculating the
+    plural form for the count costs about as much as the translation itself,
+    and keeping the results separate means arbitrary counts do not push
+    messages out of the cache.
+    """
+    key = (singular, plural, n)
+    try:
+        return api.__dict__['_plural_cache'][key]
+    except (AttributeError, KeyError):
+        pass
+    result = to_unicode(api.ngettext(singular, plural, n))
+    cache_translation(translation_cache(api, '_plural_cache'), key, result)
+    return result
+
+
 @lazy
 def lazy_gettext(message):
     """
@@ -72,8 +168,7 @@ def lazy_gettext(message):
     ``bottle.request.gettext`` set by the plugin. It will fail with
     ``AttributeError`` exception if the plugin is not installed.
     """
-    gettext = request.gettext.gettext
-    return to_unicode(gettext(message))
+    return translate(request.gettext, message)
 
 
 @lazy
@@ -85,8 +180,34 @@ def lazy_ngettext(singular, plural, n):
     ``bottle.request.gettext`` set by the plugin. It will fail with
     ``AttributeError`` exception if the plugin is not installed.
     """
-    ngettext = request.gettext.ngettext
-    return to_unicode(ngettext(singular, plural, n))
+    return translate_plural(request.gettext, singular, plural, n)
+
+
+@batch_resolver(lazy_gettext)
+def batch_gettext(calls):
+    """
+    Evaluate several :py:func:`~lazy_gettext` calls at once. This function is
+    used by :py:func:`bottle_utils.lazy.resolve`.
+    """
+    api = request.gettext
+    return [translate(api, *args, **kwargs) for args, kwargs in calls]
+
+
+@batch_resolver(lazy_ngettext)
+def batch_ngettext(calls):
+    """
+    Evaluate several :py:func:`~lazy_ngettext` calls at once. This function is
+    used by :py:func:`bottle_utils.lazy.resolve`.
+    """
+    api = request.gettext
+    return [translate_plural(api, *args, **kwargs) for args, kwargs in calls]
+
+
+def context_key(context, message):
+    """
+    Return the catalog key for ``message`` in ``context``.
+    """
+    return context + CONTEXT_SEPARATOR + message
 
 
 def lazy_pgettext(context, message):
@@ -99,10 +220,11 @@ def lazy_pgettext(context, message):
     translations may be needed in different languages.
 
     The function itself is not lazily evaluated, but its return value comes
-    from ``lazy_gettext()`` call, and it is effectively lazy as a result.
+    from ``lazy_gettext()`` call, and it is effectively lazy as a result. The
+    context key is calculated when this function is called, so it is only
+    calculated once for messages defined at module level.
     """
-    message = '%s%s%s' % (context, CONTEXT_SEPARATOR, message)
-    return lazy_gettext(message)
+    return lazy_gettext(context_key(context, message))
 
 
 def lazy_npgettext(context, singular, plural, n):
@@ -118,9 +240,8 @@ def lazy_npgettext(context, singular, plural, n):
     The function itself is not lazy, but it returns the return value of
     ``lazy_ngettext()``, and it is effectively lazy. Hence the name.
     """
-    singular = '%s%s%s' % (context, CONTEXT_SEPARATOR, singular)
-    plural = '%s%s%s' % (context, CONTEXT_SEPARATOR, plural)
-    return lazy_ngettext(singular, plural, n)
+    return lazy_ngettext(context_key(context, singular),
+                         context_key(context, plural), n)
 
 
 def full_path():
@@ -136,6 +257,50 @@ def full_path():
     return path
 
 
+def original_path():
+    """
+    Calculate the path of the current request as it was before the locale
+    prefix was stripped by :py:class:`~I18NPlugin`, including query string.
+    The plugin uses this function to provide ``request.original_path`` (see
+    :py:class:`~OriginalPath`).
+    """
+    path = request.environ.get('ORIGINAL_PATH') or request.fullpath
+    qs = request.environ.get('QUERY_STRING')
+    if qs:
+        return '%s?%s' % (path, qs)
+    return path
+
+
+class OriginalPath(object):
+    """
+    Value of ``request.original_path`` attribute set by :py:class:`~I18NPlugin`
+    before the attribute is first used. Bottle calls the ``__get__()`` method
+    of request attributes that have one, so the path is calculated using
+    :py:func:`~original_path` on first access, and the resulting string
+    replaces this object in the request environment.
+    """
+
+    key = REQUEST_EXT + 'original_path'
+
+    def __get__(self, req, owner=None):
+        value = req.environ[self.key] = original_path()
+        return value
+
+
+ORIGINAL_PATH = OriginalPath()
+
+
+def localize_path(path, locale):
+    """
+    Return ``path`` with ``locale`` prefix. If ``locale`` is empty, ``path``
+    is returned unmodified.
+    """
+    if not locale:
+        # This is a bit unexpected, but it obviously can happen
+        return path
+    return '/%s%s' % (locale, path)
+
+
 @lazy
 def i18n_path(path=None, locale=None):
     """
@@ -147,27 +312,61 @@ def i18n_path(path=None, locale=None):
 
     If ``locale`` argument is omitted, current locale is used.
     """
-    path = path or full_path()
-    locale = locale or request.locale
-    if not locale:
-        # This is a bit unexpected, but it obviously can happen
-        return path
-    return '/{}{}'.format(locale, path)
+    return localize_path(path or full_path(), locale or request.locale)
 
 
 @lazy
 def i18n_url(route, **params):
     """
     Return a named route in localized form. This function is a light wrapper
-    around Bottle's ``get_url()`` function. It passes the result to
-    :py:func:`~i18n_path`.
+    around Bottle's ``get_url()`` function (see
+    :py:func:`bottle_utils.html.quoted_url`). It passes the result to
+    :py:func:`~localize_path`.
 
     If ``locale`` keyword argument is passed, it will be used instead of the
     currently selected locale.
     """
     locale = params.pop('locale', request.locale)
-    path = quoted_url(route, **params)
-    return i18n_path(path, locale=locale)
+    return localize_path(quoted_url(route, **params), locale)
+
+
+def template_candidates(tpl_base_name, locale):
+    """
+    Return the names of localized versions of the ``tpl_base_name`` template
+    for ``locale`` in order of preference. The most specific name comes
+    first, and the base name comes last::
+
+        >>> template_candidates('foo', 'de_AT')
+        ['foo_de_at', 'foo_de', 'foo']
+
+    """
+    parts = locale.lower().split('_')
+    names = ['%s_%s' % (tpl_base_name, '_'.join(parts[:i]))
+             for i in range(len(parts), 0, -1)]
+    names.append(tpl_base_name)
+    return names
+
+
+def resolve_template(tpl_base_name, locale):
+    """
+    Return the name of the most specific existing template out of
+    :py:func:`~template_candidates`. If none of the templates exist, the base
+    name is returned.
+
+    Templates are looked up in ``bottle.TEMPLATE_PATH``. The results are
+    cached, so template directories are only searched once for each template
+    and locale, except in debug mode, where templates may be added while the
+    application is running.
+    """
+    key = (tpl_base_name, locale)
+    name = TEMPLATE_CACHE.get(key)
+    if name is not None and not bottle.DEBUG:
+        return name
+    for name in template_candidates(tpl_base_name, locale):
+        if BaseTemplate.search(name, bottle.TEMPLATE_PATH):
+            break
+    TEMPLATE_CACHE[key] = name
+    return name
 
 
 def i18n_view(tpl_base_name=None, **defaults):
@@ -175,7 +374,9 @@ def i18n_view(tpl_base_name=None, **defaults):
     Renders a template with locale name as suffix. Unlike the normal view
     decorator, the template name should not have an extension. The locale names
     are appended to the base template name using underscore ('_') as separator,
-    and lower-case locale identifier.
+    and lower-case locale identifier. If there is no template for the locale,
+    templates for less specific locales are used (see
+    :py:func:`~resolve_template`).
 
     Any additional keyword arguments are used as default template variables.
 
@@ -184,14 +385,15 @@ def i18n_view(tpl_base_name=None, **defaults):
         @i18n_view('foo')
         def render_foo():
             # Renders 'foo_en' for English locale, 'foo_fr' for French, etc.
+            # For 'de_AT' locale, renders the first existing template out of
+            # 'foo_de_at', 'foo_de', and 'foo'.
             return
     """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             try:
-                locale = request.locale
-                tpl_name = '%s_%s' % (tpl_base_name, locale.lower())
+                tpl_name = resolve_template(tpl_base_name, request.locale)
             except AttributeError:
                 tpl_name = tpl_base_name
             tplvars = defaults.copy()
@@ -210,6 +412,182 @@ class I18NWarning(RuntimeWarning):
     pass
 
 
+def parse_accept_language(header):
+    """
+    Parse ``Accept-Language`` header value into a tuple of lower-case language
+    tags ordered by quality value, from most to least preferred. Languages
+    with quality value of 0 are omitted. ::
+
+        >>> parse_accept_language('de-CH, en;q=0.5, fr;q=0.8, it;q=0')
+        ('de-ch', 'fr', 'en')
+
+    The results are cached, because the number of distinct header values is
+    usually small compared to the number of requests.
+    """
+    languages = ACCEPT_LANGUAGE_CACHE.get(header)
+    if languages is not None:
+        return languages
+    qualities = []
+    for item in header.split(','):
+        lang, _, params = item.partition(';')
+        lang = lang.strip().lower()
+        if not lang:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            qualities.append((-quality, len(qualities), lang))
+    languages = tuple(lang for _, _, lang in sorted(qualities))
+    ACCEPT_LANGUAGE_CACHE[header] = languages
+    return languages
+
+
+def load_translations(domain, locale_dir, locale):
+    """
+    Load the translations for ``locale`` from .mo files in ``locale_dir``.
+    This function works the same way as ``gettext.translation()``, but it
+    always reads the .mo files instead of returning cached translations
+    objects. Raises ``IOError`` if no .mo file is found.
+    """
+    paths = gettext.find(domain, locale_dir, languages=[locale], all=True)
+    if not paths:
+        raise IOError("No MO file found for '%s' locale" % locale)
+    api = None
+    for path in paths:
+        with open(path, 'rb') as f:
+            translations = gettext.GNUTranslations(f)
+        if api is None:
+            api = translations
+        else:
+            api.add_fallback(translations)
+    return api
+
+
+def get_plural_expr(api):
+    """
+    Return the plural expression from the ``Plural-Forms`` header of the
+    specified ``gettext.GNUTranslations`` object, or ``None`` if it does not
+    have one.
+    """
+    plural_forms = api.info().get('plural-forms')
+    if not plural_forms:
+        return None
+    return plural_forms.split(';')[1].split('plural=')[1]
+
+
+class CompiledTranslations(gettext.GNUTranslations):
+    """
+    Translation API object created from the data stored by
+    :py:func:`~compile_catalogs`. It behaves the same as the
+    ``gettext.GNUTranslations`` object it was created from, but it does not
+    need to parse the .mo file. Fallback translations (e.g., 'de' for 'de_AT'
+    locale) are stored separately, and they are added using
+    ``add_fallback()`` when the catalog is loaded.
+    """
+
+    def __init__(self, catalog, plural, info, charset):
+        gettext.NullTranslations.__init__(self)
+        self._catalog = catalog
+        self._info = info
+        self._charset = charset
+        if plural:
+            self.plural = gettext.c2py(plural)
+        else:
+            self.plural = lambda n: int(n != 1)
+
+
+def compile_catalogs(locale_dir, locales, path, domain='messages'):
+    """
+    Compile the .mo files for ``locales`` found in ``locale_dir`` into a
+    single catalog file at ``path``. The catalog file can be passed to
+    :py:class:`~I18NPlugin` using the ``catalog`` argument to avoid parsing
+    the .mo files when the application starts.
+
+    This function is meant to be called at deploy time. The catalog file uses
+    the ``pickle`` format of the Python version that created it, so it should
+    be created using the same Python version that runs the application, and
+    it must only be loaded from trusted locations.
+
+    Locales that have no .mo file are omitted from the catalog file, and a
+    warning is emitted for each of them.
+    """
+    index = {}
+    blobs = []
+    offset = 0
+    for locale in locales:
+        try:
+            api = load_translations(domain, locale_dir, locale)
+        except (IOError, OSError):
+            warn(I18NWarning("No MO file found for '%s' locale" % locale))
+            continue
+        chain = []
+        while api is not None:
+            chain.append((api._catalog, get_plural_expr(api), api.info(),
+                          api.charset()))
+            api = api._fallback
+        blob = pickle.dumps(chain, pickle.HIGHEST_PROTOCOL)
+        index[locale] = (offset, len(blob))
+        offset += len(blob)
+        blobs.append(blob)
+    index = pickle.dumps(index, pickle.HIGHEST_PROTOCOL)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CATALOG_HEADER.pack(len(index)))
+        f.write(index)
+        for blob in blobs:
+            f.write(blob)
+    # Replace the file atomically so running processes never see a partially
+    # written catalog file
+    os.rename(tmp_path, path)
+
+
+class CompiledCatalogs(dict):
+    """
+    Dictionary that maps locales to translation API objects loaded from a
+    catalog file created by :py:func:`~compile_catalogs`. Only the index of
+    the catalog file is read when this object is created, and the translations
+    for each locale are loaded on first use.
+
+    Locales that are not found in the catalog file are mapped to the generic
+    ``gettext`` API, and a warning is emitted when such locale is first used.
+    """
+
+    def __init__(self, path, locales):
+        super(CompiledCatalogs, self).__init__()
+        self.path = path
+        self.locales = locales
+        with open(path, 'rb') as f:
+            size, = CATALOG_HEADER.unpack(f.read(CATALOG_HEADER.size))
+            self.index = pickle.loads(f.read(size))
+        self.data_offset = CATALOG_HEADER.size + size
+
+    def __contains__(self, locale):
+        return locale in self.locales
+
+    def __missing__(self, locale):
+        if locale not in self.locales:
+            raise KeyError(locale)
+        try:
+            offset, size = self.index[locale]
+        except KeyError:
+            warn(I18NWarning("No catalog found for '%s' locale" % locale))
+            api = gettext
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(self.data_offset + offset)
+                chain = pickle.loads(f.read(size))
+            api = CompiledTranslations(*chain[0])
+            for data in chain[1:]:
+                api.add_fallback(CompiledTranslations(*data))
+        self[locale] = api
+        return api
+
+
 class I18NPlugin(object):
     """
     Bottle plugin and WSGI middleware for handling i18n routes.  This class is
@@ -276,6 +654,31 @@ class I18NPlugin(object):
 
     The ``LANG`` should match any of the supported languages, and ``DOMAIN``
     should match the specified domain.
+
+    Parsing .mo files for many locales can make the application start slowly.
+    To avoid this, the .mo files can be compiled into a single catalog file at
+    deploy time using :py:func:`~compile_catalogs`, and the path of that file
+    passed as ``catalog`` argument. In this case, the ``locale_dir`` argument
+    is not used, and translations for each locale are loaded when they are
+    first used, so each process only loads the locales it serves.
+
+    Additional path prefixes can be mapped to supported locales using the
+    ``aliases`` argument, which is a dict mapping aliases to locales (e.g.,
+    ``{'pt': 'pt_BR'}``). Matching of locales and aliases is case-insensitive.
+
+    When ``negotiate`` argument is ``True``, requests without a locale prefix
+    are redirected to the locale selected by the ``locale`` cookie or, if
+    there is no cookie, the best match for the ``Accept-Language`` header,
+    instead of the default locale. If ``serve_unprefixed`` is also ``True``,
+    such requests are not redirected at all. They are served in the selected
+    locale with ``Content-Language`` and ``Vary`` headers, which saves
+    first-time visitors a round trip.
+
+    Translations can be reloaded without restarting the application by
+    passing the ``reload_interval`` argument. The modification times of the
+    .mo files (or the catalog file) for a locale are then checked when the
+    locale is used, at most once every ``reload_interval`` seconds, and the
+    translations are replaced if the files have changed.
     """
 
     # Bottle plugin name
@@ -284,7 +687,9 @@ class I18NPlugin(object):
     api = 2
 
     def __init__(self, app, langs, default_locale, locale_dir,
-                 domain='messages', noplugin=False):
+                 domain='messages', noplugin=False, catalog=None,
+                 aliases=None, negotiate=False, serve_unprefixed=False,
+                 reload_interval=None):
         # The original bottle application object is accessible as ``app``
         # attribute after initialization.
         self.app = app
@@ -295,6 +700,28 @@ class I18NPlugin(object):
         # Supported locales (calculated based on ``langs`` iterable).
         self.locales = [lang[0] for lang in langs]
 
+        # Mapping between lower-case path prefixes and supported locales,
+        # including any aliases.
+        self.locale_map = dict((locale.lower(), locale)
+                               for locale in self.locales)
+        for alias, locale in (aliases or {}).items():
+            if locale not in self.locales:
+                raise ValueError("Alias '%s' points to unsupported locale "
+                                 "'%s'" % (alias, locale))
+            self.locale_map[alias.lower()] = locale
+
+        # Mapping between lower-case language codes and the first supported
+        # locale for that language, used for ``Accept-Language`` matching.
+        self.language_map = {}
+        for locale in self.locales:
+            self.language_map.setdefault(locale.lower().split('_')[0], locale)
+
+        # Whether locale is negotiated for requests without locale prefix
+        self.negotiate = negotiate
+
+        # Whether requests without locale prefix are served without redirect
+        self.serve_unprefixed = serve_unprefixed
+
         # Default locale.
         self.default_locale = default_locale
 
@@ -304,19 +731,38 @@ class I18NPlugin(object):
         # Domain of the translation.
         self.domain = domain
 
+        # Path of the compiled catalog file, if any
+        self.catalog = catalog
+
         # A dictionary that maps locales to ``gettext.translation()`` objects
         # for each locale. Appropriate API object is selected from each
-        self.gettext_apis = {}
-
-        # Prepare gettext class-based APIs for consumption
-        for locale in self.locales:
-            try:
-                api = gettext.translation(domain, locale_dir,
-                                          languages=[locale])
-            except OSError:
-                api = gettext
-                warn(I18NWarning("No MO file found for '%s' locale" % locale))
-            self.gettext_apis[locale] = api
+        if catalog:
+            # Translations are loaded from the catalog file on first use
+            self.gettext_apis = CompiledCatalogs(catalog, self.locales)
+        else:
+            self.gettext_apis = {}
+            # Prepare gettext class-based APIs for consumption
+            for locale in self.locales:
+                try:
+                    api = gettext.translation(domain, locale_dir,
+                                              languages=[locale])
+                except OSError:
+                    api = gettext
+                    warn(I18NWarning("No MO file found for '%s' locale" %
+                                     locale))
+                self.gettext_apis[locale] = api
+
+        # Minimum number of seconds between checks for changed translation
+        # files, or ``None`` if translations are not reloaded.
+        self.reload_interval = reload_interval
+
+        # Modification times of translation files, and times of next checks,
+        # for each locale (or ``None`` key for the catalog file).
+        self.signatures = {}
+        self.next_checks = {}
+        if reload_interval is not None:
+            for locale in [None] if catalog else self.locales:
+                self.signatures[locale] = self.get_signature(locale)
 
         # Provide translation methods to templates
         BaseTemplate.defaults.update({
@@ -359,34 +805,172 @@ class I18NPlugin(object):
         except AttributeError:
             ignored = False
 
-        def wrapper(*args, **kwargs):
-            request.original_path = request.environ.get('ORIGINAL_PATH',
-                                                        request.fullpath)
-            query_string = request.environ.get('QUERY_STRING')
-            if query_string:
-                request.original_path = '{0}?{1}'.format(request.original_path,
-                                                         query_string)
-            default_locale = request.get_cookie('locale', self.default_locale)
-            if not ignored:
-                request.default_locale = default_locale
-                request.locale = locale = request.environ.get('LOCALE')
-                if locale:
-                    response.set_cookie('locale', locale, path='/')
-                if locale not in self.locales:
-                    # If no locale had been specified, redirect to default one
-                    path = request.original_path
-                    redirect(i18n_path(path, default_locale))
-                else:
-                    request.gettext = self.gettext_apis[locale]
-            else:
+        if ignored:
+            def wrapper(*args, **kwargs):
+                environ = request.environ
+                environ[OriginalPath.key] = ORIGINAL_PATH
                 # Dummy translation is used for paths which are excepted from
                 # i18n plugin.
-                request.gettext = gettext.NullTranslations()
-                request.locale = default_locale
+                environ[REQUEST_EXT + 'gettext'] = NULL_TRANSLATIONS
+                environ[REQUEST_EXT + 'locale'] = request.get_cookie(
+                    'locale', self.default_locale)
+                return callback(*args, **kwargs)
+            return wrapper
 
-            return callback(*args, **kwargs)
+        locales = frozenset(self.locales)
+
+        def wrapper(*args, **kwargs):
+            environ = request.environ
+            environ[OriginalPath.key] = ORIGINAL_PATH
+            if 'HTTP_COOKIE' in environ:
+                cookie_locale = request.get_cookie('locale')
+            else:
+                # Parsing cookies is relatively expensive, so it is skipped
+                # when there are none
+                cookie_locale = None
+            default_locale = cookie_locale or self.default_locale
+            locale = environ.get('LOCALE')
+            negotiated = False
+            if locale not in locales and self.negotiate:
+                default_locale = self.negotiate_locale()
+                if self.serve_unprefixed:
+                    locale = default_locale
+                    negotiated = True
+                else:
+                    self.set_negotiation_headers(response)
+            elif locale and locale != cookie_locale:
+                response.set_cookie('locale', locale, path='/')
+            environ[REQUEST_EXT + 'default_locale'] = default_locale
+            environ[REQUEST_EXT + 'locale'] = locale
+            if locale not in locales:
+                # If no locale had been specified, redirect to default one
+                redirect(localize_path(request.original_path, default_locale))
+            environ[REQUEST_EXT + 'gettext'] = self.get_translations(locale)
+            if not negotiated:
+                return callback(*args, **kwargs)
+            # Bottle replaces the headers of the global response with the
+            # headers of HTTPResponse objects returned or raised by handlers
+            self.set_negotiation_headers(response, locale)
+            try:
+                result = callback(*args, **kwargs)
+            except HTTPResponse as exc:
+                self.set_negotiation_headers(exc, locale)
+                raise
+            if isinstance(result, HTTPResponse):
+                self.set_negotiation_headers(result, locale)
+            return result
         return wrapper
 
+    @staticmethod
+    def set_negotiation_headers(resp, locale=None):
+        """
+        Set headers on the ``resp`` response object which tell caches that the
+        response depends on the negotiated locale. If ``locale`` is specified,
+        it is used as Content-Language. The Vary header is extended if it is
+        already set (e.g., responses returned by ``redirect()`` copy the
+        headers of the current response, which may already have it).
+        """
+        vary = resp.get_header('Vary')
+        if not vary:
+            resp.set_header('Vary', 'Accept-Language, Cookie')
+        elif 'Accept-Language' not in vary:
+            resp.set_header('Vary', vary + ', Accept-Language, Cookie')
+        if locale:
+            resp.set_header('Content-Language', locale.replace('_', '-'))
+
+    def get_translations(self, locale):
+        """
+        Return the translation API object for ``locale``. If translations are
+        reloaded, this method calls :py:meth:`~check_reload` first.
+        """
+        if self.reload_interval is not None:
+            self.check_reload(locale)
+        return self.gettext_apis[locale]
+
+    def get_signature(self, locale):
+        """
+        Return modification times of the files that translations for
+        ``locale`` are loaded from. If catalog file is used, ``locale`` is
+        ignored.
+        """
+        if self.catalog:
+            paths = [self.catalog]
+        else:
+            paths = gettext.find(self.domain, self.locale_dir,
+                                 languages=[locale], all=True)
+        signature = []
+        for path in paths:
+            try:
+                signature.append(os.stat(path).st_mtime)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def check_reload(self, locale):
+        """
+        Reload translations for ``locale`` if the files they are loaded from
+        have changed. The files are checked at most once every
+        ``reload_interval`` seconds for each locale.
+
+        If the new files cannot be loaded (e.g., because they are still being
+        written), the old translations are kept, and loading is retried on
+        next check.
+        """
+        key = None if self.catalog else locale
+        now = time.time()
+        if now < self.next_checks.get(key, 0):
+            return
+        self.next_checks[key] = now + self.reload_interval
+        signature = self.get_signature(locale)
+        if signature == self.signatures.get(key):
+            return
+        try:
+            self.reload_translations(locale)
+        except Exception as exc:
+            warn(I18NWarning("Could not reload translations for '%s' locale: "
+                             "%s" % (locale, exc)))
+            return
+        self.signatures[key] = signature
+
+    def reload_translations(self, locale):
+        """
+        Load translations for ``locale`` from the .mo files, and replace the
+        translation API object used for that locale. If catalog file is used,
+        the catalog file is loaded again, and translations for all locales are
+        replaced.
+        """
+        if self.catalog:
+            self.gettext_apis = CompiledCatalogs(self.catalog, self.locales)
+            return
+        # ``gettext.translation()`` would return the cached translations
+        self.gettext_apis[locale] = load_translations(self.domain,
+                                                      self.locale_dir, locale)
+
+    def negotiate_locale(self):
+        """
+        Select the locale for a request that has no locale prefix. The locale
+        stored in the ``locale`` cookie is used if it is supported. Otherwise,
+        the best match for the ``Accept-Language`` header is used, falling
+        back to the default locale.
+
+        Language tags in the header match locales regardless of case and
+        separator (e.g., ``pt-br`` matches ``pt_BR``), and a tag that has no
+        matching locale matches the first locale with the same language (e.g.,
+        ``de-CH`` or ``de`` match ``de_DE``).
+        """
+        locale = request.get_cookie('locale')
+        if locale in self.locales:
+            return locale
+        header = request.environ.get('HTTP_ACCEPT_LANGUAGE')
+        if header:
+            for lang in parse_accept_language(header):
+                lang = lang.replace('-', '_')
+                locale = (self.locale_map.get(lang) or
+                          self.language_map.get(lang.split('_')[0]))
+                if locale:
+                    return locale
+        return self.default_locale
+
     def match_locale(self, path):
         """
         Match the locale based on prefix in request path. You can customize
@@ -399,11 +983,9 @@ class I18NPlugin(object):
         as ``LOCALE`` key. It is then used by the plugin part of this class to
         provide translation methods to the rest of the app.
         """
-        path_prefix = path.split('/')[1].lower()
-        for locale in self.locales:
-            if path_prefix == locale.lower():
-                return locale
-        return None
+        end = path.find('/', 1)
+        path_prefix = path[1:] if end == -1 else path[1:end]
+        return self.locale_map.get(path_prefix.lower())
 
     @staticmethod
     def strip_prefix(path, locale):
@@ -413,8 +995,14 @@ class I18NPlugin(object):
         return value of this method replaces the ``PATH_INFO`` key in the
         environment dictionary, and the original path is saved in
         ``ORIGINAL_PATH`` key.
+
+        The whole first path segment is removed, so the prefix may be an alias
+        of the ``locale`` rather than the locale itself.
         """
-        return path[len(locale) + 1:]
+        end = path.find('/', 1)
+        if end == -1:
+            return ''
+        return path[end:]
 
     def set_locale(self, locale):
         """
@@ -423,3 +1011,10 @@ class I18NPlugin(object):
         """
         request.locale = locale
         response.set_cookie('locale', locale, path='/')
+
+
+if __name__ == '__main__':
+    # Command line interface (``python -m bottle_utils.i18n``)
+    import sys
+    from bottle_utils.i18n_tools import main
+    sys.exit(main())
@@ -0,0 +1,500 @@
+"""
+.. module:: bottle_utils.i18n_tools
+   :synopsis: Message extraction and catalog compilation
+
+.. moduleauthor:: Outernet Inc <hello@outernet.is>
+
+This module implements the command line interface of the
+:py:mod:`bottle_utils.i18n` module::
+
+    python -m bottle_utils.i18n extract -o locales/messages.pot app/ views/
+    python -m bottle_utils.i18n compile locales/
+    python -m bottle_utils.i18n catalog locales/ catalog.bin -l de_DE -l fr_FR
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import io
+import os
+import re
+import ast
+import sys
+import struct
+import tokenize
+import argparse
+import multiprocessing
+from collections import OrderedDict
+
+from .common import to_unicode
+from .i18n import CONTEXT_SEPARATOR, compile_catalogs
+
+__all__ = ('extract_python', 'extract_template', 'extract_file', 'extract',
+           'find_sources', 'write_pot', 'read_po', 'write_mo', 'compile_po',
+           'compile_mo_files', 'main')
+
+# Translation functions and the meaning of their arguments
+KEYWORDS = {
+    '_': ('msgid',),
+    'gettext': ('msgid',),
+    'lazy_gettext': ('msgid',),
+    'ngettext': ('msgid', 'msgid_plural'),
+    'lazy_ngettext': ('msgid', 'msgid_plural'),
+    'pgettext': ('msgctxt', 'msgid'),
+    'lazy_pgettext': ('msgctxt', 'msgid'),
+    'npgettext': ('msgctxt', 'msgid', 'msgid_plural'),
+    'lazy_npgettext': ('msgctxt', 'msgid', 'msgid_plural'),
+}
+
+# Comments that start with this tag are extracted for translators
+COMMENT_TAG = 'translators'
+
+PYTHON_EXTENSIONS = ('.py',)
+TEMPLATE_EXTENSIONS = ('.tpl', '.html', '.thtml', '.stpl')
+
+# Python code in SimpleTemplate templates: ``<% block %>``, ``% line``, and
+# ``{{ expression }}``
+TEMPLATE_CODE_RE = re.compile(r'<%(.*?)%>|^[ \t]*%(?!%)([^\n]*)|'
+                              r'\{\{!?(.*?)\}\}', re.M | re.S)
+
+PO_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', '"': '"'}
+PO_ESCAPE_RE = re.compile(r'\\(.)')
+PO_KEYWORD_RE = re.compile(r'^(msgctxt|msgid_plural|msgid|msgstr)'
+                           r'(?:\[(\d+)\])?\s+(".*")$')
+
+POT_HEADER = ('MIME-Version: 1.0\n'
+              'Content-Type: text/plain; charset=UTF-8\n'
+              'Content-Transfer-Encoding: 8bit\n'
+              'Plural-Forms: nplurals=INTEGER; plural=EXPRESSION;\n')
+
+MO_MAGIC = 0x950412de
+
+SKIPPED_TOKENS = (tokenize.NL, tokenize.COMMENT)
+
+
+def _literal(token):
+    # Return the value of a string literal token, or ``None`` for strings that
+    # are not constant (e.g., f-strings)
+    try:
+        return to_unicode(ast.literal_eval(token))
+    except (ValueError, SyntaxError):
+        return None
+
+
+def _read_args(tokens, start):
+    # Read the arguments of a call starting at index ``start`` (the opening
+    # parenthesis). Return the arguments as list of strings, with ``None`` for
+    # arguments that are not string literals, and the index of the closing
+    # parenthesis.
+    args = []
+    current = []
+    depth = 0
+    for index in range(start, len(tokens)):
+        toktype, value = tokens[index][:2]
+        if toktype in SKIPPED_TOKENS:
+            continue
+        if toktype == tokenize.OP and value in '([{':
+            depth += 1
+            if depth > 1:
+                current = None
+        elif toktype == tokenize.OP and value in ')]}':
+            depth -= 1
+            if depth == 0:
+                if current != []:
+                    args.append(current)
+                break
+        elif depth == 1 and toktype == tokenize.OP and value == ',':
+            args.append(current)
+            current = []
+        elif depth == 1 and toktype == tokenize.STRING and current is not None:
+            literal = _literal(value)
+            current = None if literal is None else current + [literal]
+        elif depth == 1:
+            current = None
+    return [''.join(arg) if arg else None for arg in args], index
+
+
+def _extract_tokens(tokens, keywords=KEYWORDS):
+    # Yield messages found in a list of tokens as ``(lineno, msgctxt, msgid,
+    # msgid_plural, comments)`` tuples
+    comments = []
+    comment_line = None
+    previous = None
+    index = 0
+    while index < len(tokens):
+        toktype, value, (lineno, _) = tokens[index][:3]
+        if toktype == tokenize.COMMENT:
+            text = value.lstrip('#').strip()
+            if text.lower().startswith(COMMENT_TAG):
+                comments = [text]
+                comment_line = lineno
+            elif comments and lineno == comment_line + 1:
+                comments.append(text)
+                comment_line = lineno
+        elif (toktype == tokenize.NAME and value in keywords and
+              previous not in ('def', 'class', '.')):
+            nxt = index + 1
+            while nxt < len(tokens) and tokens[nxt][0] in SKIPPED_TOKENS:
+                nxt += 1
+            if nxt < len(tokens) and tokens[nxt][1] == '(':
+                args, end = _read_args(tokens, nxt)
+                spec = keywords[value]
+                if len(args) >= len(spec) and None not in args[:len(spec)]:
+                    message = dict(zip(spec, args))
+                    if comments and lineno - comment_line > 1:
+                        comments = []
+                    yield (lineno, message.get('msgctxt'), message['msgid'],
+                           message.get('msgid_plural'), comments)
+                    comments = []
+                # Translation calls may be nested in arguments of other
+                # translation calls, so continue after the parenthesis
+                index = nxt
+        if toktype not in SKIPPED_TOKENS:
+            previous = value
+        index += 1
+
+
+def _tokenize(source):
+    readline = io.StringIO(to_unicode(source)).readline
+    return list(tokenize.generate_tokens(readline))
+
+
+def extract_python(source, keywords=KEYWORDS):
+    """
+    Extract translatable messages from Python source code. Returns a list of
+    ``(lineno, msgctxt, msgid, msgid_plural, comments)`` tuples, where
+    ``msgctxt`` and ``msgid_plural`` are ``None`` if the message has no
+    context or plural form, and ``comments`` is a list of comment lines
+    that start with ``Translators:`` tag and immediately precede the message.
+
+    Messages are only extracted from calls to functions in ``keywords`` whose
+    arguments are string literals.
+    """
+    try:
+        tokens = _tokenize(source)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return []
+    return list(_extract_tokens(tokens, keywords=keywords))
+
+
+def extract_template(source, keywords=KEYWORDS):
+    """
+    Extract translatable messages from SimpleTemplate source. Python code in
+    code blocks, code lines, and inline expressions is processed the same way
+    as by :py:func:`~extract_python`.
+    """
+    tokens = []
+    for match in TEMPLATE_CODE_RE.finditer(source):
+        code = next(group for group in match.groups() if group is not None)
+        stripped = code.lstrip()
+        start = match.start(match.lastindex)
+        offset = source.count('\n', 0, start) + code.count(
+            '\n', 0, len(code) - len(stripped))
+        try:
+            segment = _tokenize(stripped)
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            continue
+        # Tokens of all code segments are processed together, so that
+        # comments in one segment apply to messages in the next one
+        for toktype, value, (row, col), (erow, ecol), line in segment:
+            tokens.append((toktype, value, (row + offset, col),
+                           (erow + offset, ecol), line))
+    return list(_extract_tokens(tokens, keywords=keywords))
+
+
+def extract_file(path):
+    """
+    Extract translatable messages from the file at ``path``. The file is
+    treated as a template unless it has a ``.py`` extension. Returns a
+    ``(path, messages)`` tuple where ``messages`` is a list in the format
+    returned by :py:func:`~extract_python`.
+    """
+    with io.open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    if path.endswith(PYTHON_EXTENSIONS):
+        return path, extract_python(source)
+    return path, extract_template(source)
+
+
+def find_sources(paths):
+    """
+    Return a list of Python and template files found in ``paths``, which may
+    contain both files and directories. Directories are searched recursively.
+    """
+    extensions = PYTHON_EXTENSIONS + TEMPLATE_EXTENSIONS
+    sources = []
+    for path in paths:
+        if not os.path.isdir(path):
+            sources.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(extensions):
+                    sources.append(os.path.join(dirpath, filename))
+    return sources
+
+
+def extract(paths, jobs=None):
+    """
+    Extract translatable messages from files in ``paths`` (see
+    :py:func:`~find_sources`) using a pool of ``jobs`` processes. If ``jobs``
+    is omitted, one process per CPU is used.
+
+    Returns an ordered dict mapping ``(msgctxt, msgid)`` keys to dicts with
+    ``msgid_plural``, ``locations`` and ``comments`` keys. Messages are
+    ordered by their first occurrence.
+    """
+    sources = find_sources(paths)
+    if jobs == 1 or len(sources) < 2:
+        results = [extract_file(path) for path in sources]
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(extract_file, sources)
+        finally:
+            pool.close()
+            pool.join()
+    catalog = OrderedDict()
+    for path, messages in results:
+        for lineno, msgctxt, msgid, msgid_plural, comments in messages:
+            entry = catalog.setdefault((msgctxt, msgid), {
+                'msgid_plural': None,
+                'locations': [],
+                'comments': [],
+            })
+            entry['msgid_plural'] = entry['msgid_plural'] or msgid_plural
+            entry['locations'].append((path, lineno))
+            for comment in comments:
+                if comment not in entry['comments']:
+                    entry['comments'].append(comment)
+    return catalog
+
+
+def _po_string(keyword, value):
+    # Format ``keyword "value"`` line(s) for a .po file
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"')
+               .replace('\t', '\\t').replace('\r', '\\r'))
+    lines = escaped.split('\n')
+    if len(lines) == 1:
+        return '%s "%s"\n' % (keyword, escaped)
+    # Multi-line strings are split after each newline
+    parts = [line + '\\n' for line in lines[:-1]]
+    if lines[-1]:
+        parts.append(lines[-1])
+    return '%s ""\n%s' % (keyword, ''.join('"%s"\n' % p for p in parts))
+
+
+def write_pot(catalog, path):
+    """
+    Write ``catalog`` returned by :py:func:`~extract` to a .pot file at
+    ``path``.
+    """
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(_po_string('msgid', ''))
+        f.write(_po_string('msgstr', POT_HEADER))
+        for (msgctxt, msgid), entry in catalog.items():
+            f.write('\n')
+            for comment in entry['comments']:
+                f.write('#. %s\n' % comment)
+            for location in entry['locations']:
+                f.write('#: %s:%s\n' % location)
+            if msgctxt is not None:
+                f.write(_po_string('msgctxt', msgctxt))
+            f.write(_po_string('msgid', msgid))
+            if entry['msgid_plural'] is None:
+                f.write(_po_string('msgstr', ''))
+            else:
+                f.write(_po_string('msgid_plural', entry['msgid_plural']))
+                f.write(_po_string('msgstr[0]', ''))
+                f.write(_po_string('msgstr[1]', ''))
+
+
+def _po_unquote(value):
+    return PO_ESCAPE_RE.sub(lambda m: PO_ESCAPES.get(m.group(1), m.group(1)),
+                            value[1:-1])
+
+
+def read_po(path):
+    """
+    Read a UTF-8 encoded .po file at ``path``. Returns a list of dicts with
+    ``msgctxt``, ``msgid``, ``msgid_plural``, ``msgstr`` (list of
+    translations, one for each plural form), and ``fuzzy`` keys. Obsolete
+    entries are omitted.
+    """
+    entries = []
+    entry = None
+    key = None
+    fuzzy = False
+    with io.open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#~'):
+                continue
+            if line.startswith('#'):
+                if line.startswith('#,') and 'fuzzy' in line:
+                    fuzzy = True
+                continue
+            if line.startswith('"'):
+                if entry is not None and key is not None:
+                    entry[key[0]][key[1]] += _po_unquote(line)
+                continue
+            match = PO_KEYWORD_RE.match(line)
+            if not match:
+                continue
+            keyword, index, value = match.groups()
+            if keyword in ('msgctxt', 'msgid') and (
+                    entry is None or key[0] == 'msgstr'):
+                entry = {'msgctxt': [None], 'msgid': [''],
+                         'msgid_plural': [None], 'msgstr': {},
+                         'fuzzy': fuzzy}
+                entries.append(entry)
+                fuzzy = False
+            key = (keyword, int(index or 0) if keyword == 'msgstr' else 0)
+            if keyword == 'msgstr':
+                entry['msgstr'][key[1]] = _po_unquote(value)
+            else:
+                entry[keyword][0] = _po_unquote(value)
+    for entry in entries:
+        for keyword in ('msgctxt', 'msgid', 'msgid_plural'):
+            entry[keyword] = entry[keyword][0]
+        msgstr = entry['msgstr']
+        entry['msgstr'] = [msgstr[i] for i in sorted(msgstr)]
+    return entries
+
+
+def write_mo(entries, path):
+    """
+    Write ``entries`` in the format returned by :py:func:`~read_po` to a .mo
+    file at ``path``. Fuzzy and untranslated entries are omitted, except for
+    the header entry.
+    """
+    messages = {}
+    for entry in entries:
+        msgid = entry['msgid']
+        if msgid and (entry['fuzzy'] or not any(entry['msgstr'])):
+            continue
+        if entry['msgid_plural'] is not None:
+            msgid += '\0' + entry['msgid_plural']
+        if entry['msgctxt'] is not None:
+            msgid = entry['msgctxt'] + CONTEXT_SEPARATOR + msgid
+        messages[msgid.encode('utf-8')] = '\0'.join(
+            entry['msgstr']).encode('utf-8')
+    keys = sorted(messages)
+    ids = b''
+    strs = b''
+    offsets = []
+    for key in keys:
+        offsets.append((len(key), len(ids), len(messages[key]), len(strs)))
+        ids += key + b'\0'
+        strs += messages[key] + b'\0'
+    count = len(keys)
+    ids_start = 7 * 4 + 16 * count
+    strs_start = ids_start + len(ids)
+    data = [struct.pack(str('<7I'), MO_MAGIC, 0, count, 7 * 4,
+                        7 * 4 + 8 * count, 0, 0)]
+    for id_len, id_offset, _, _ in offsets:
+        data.append(struct.pack(str('<2I'), id_len, ids_start + id_offset))
+    for _, _, str_len, str_offset in offsets:
+        data.append(struct.pack(str('<2I'), str_len, strs_start + str_offset))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b''.join(data) + ids + strs)
+    os.rename(tmp_path, path)
+
+
+def compile_po(paths):
+    """
+    Compile the .po file to a .mo file. The ``paths`` argument is a
+    ``(po_path, mo_path)`` tuple, so this function can be used with
+    ``multiprocessing.Pool.map()``. Returns the ``mo_path``.
+    """
+    po_path, mo_path = paths
+    write_mo(read_po(po_path), mo_path)
+    return mo_path
+
+
+def compile_mo_files(locale_dir, domain='messages', force=False, jobs=None):
+    """
+    Compile ``LANG/LC_MESSAGES/DOMAIN.po`` files in ``locale_dir`` to .mo
+    files using a pool of ``jobs`` processes. Only .po files that are newer
+    than the matching .mo files are compiled, unless ``force`` is ``True``.
+    Returns a list of compiled .mo files.
+    """
+    pending = []
+    for lang in sorted(os.listdir(locale_dir)):
+        po_path = os.path.join(locale_dir, lang, 'LC_MESSAGES',
+                               domain + '.po')
+        if not os.path.isfile(po_path):
+            continue
+        mo_path = po_path[:-3] + '.mo'
+        if (force or not os.path.exists(mo_path) or
+                os.path.getmtime(po_path) > os.path.getmtime(mo_path)):
+            pending.append((po_path, mo_path))
+    if jobs == 1 or len(pending) < 2:
+        return [compile_po(paths) for paths in pending]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(compile_po, pending)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    """
+    Run the command line interface with ``argv`` arguments (defaults to
+    ``sys.argv[1:]``).
+    """
+    parser = argparse.ArgumentParser(prog='python -m bottle_utils.i18n',
+                                     description='Manage translations')
+    commands = parser.add_subparsers(dest='command')
+
+    cmd = commands.add_parser('extract', help='extract messages to .pot file')
+    cmd.add_argument('paths', nargs='+', metavar='PATH',
+                     help='source file or directory')
+    cmd.add_argument('-o', '--output', default='messages.pot',
+                     help='output file (default: %(default)s)')
+    cmd.add_argument('-j', '--jobs', type=int, default=None,
+                     help='number of processes (default: number of CPUs)')
+
+    cmd = commands.add_parser('compile', help='compile changed .po files')
+    cmd.add_argument('locale_dir', help='locale directory')
+    cmd.add_argument('-d', '--domain', default='messages',
+                     help='message domain (default: %(default)s)')
+    cmd.add_argument('-f', '--force', action='store_true',
+                     help='compile all .po files')
+    cmd.add_argument('-j', '--jobs', type=int, default=None,
+                     help='number of processes (default: number of CPUs)')
+
+    cmd = commands.add_parser('catalog', help='compile .mo files into a '
+                              'catalog file for I18NPlugin')
+    cmd.add_argument('locale_dir', help='locale directory')
+    cmd.add_argument('output', help='output file')
+    cmd.add_argument('-l', '--locale', action='append', dest='locales',
+                     required=True, help='locale (can be repeated)')
+    cmd.add_argument('-d', '--domain', default='messages',
+                     help='message domain (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'extract':
+        catalog = extract(args.paths, args.jobs)
+        write_pot(catalog, args.output)
+        print('Extracted %s messages to %s' % (len(catalog), args.output))
+    elif args.command == 'compile':
+        compiled = compile_mo_files(args.locale_dir, args.domain, args.force,
+                                    args.jobs)
+        for path in compiled:
+            print('Compiled %s' % path)
+    elif args.command == 'catalog':
+        compile_catalogs(args.locale_dir, args.locales, args.output,
+                         args.domain)
+        print('Wrote %s' % args.output)
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
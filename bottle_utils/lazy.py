@@ -5,11 +5,81 @@
 .. moduleauthor:: Outernet Inc <hello@outernet.is>
 """
 
+import operator
+import threading
 from functools import wraps
 
+from bottle import request
+
 from .common import to_unicode, to_bytes
 
-__all__ = ('Lazy', 'CachingLazy', 'lazy', 'caching_lazy')
+__all__ = ('Lazy', 'CachingLazy', 'ThreadCachingLazy', 'RequestCachingLazy',
+           'lazy', 'caching_lazy', 'request_caching_lazy', 'request_key',
+           'resolve', 'batch_resolver')
+
+REQUEST_KEY = 'bottle_utils.request_key'
+
+# Marks absence of a value where ``None`` is a valid value
+NOTSET = object()
+
+# Guards creation of per-object locks in CachingLazy
+LOCK = threading.Lock()
+
+# Functions that evaluate several lazy calls at once, keyed by the function
+# that is being wrapped in the lazy objects
+BATCH_RESOLVERS = {}
+
+# Operators that are delegated to the evaluated value. Each of these is added
+# to the :py:class:`~Lazy` class as a method that evaluates the proxy exactly
+# once, so an expression such as ``lazy_str * 2`` or ``len(lazy_str)`` only
+# calls the wrapped function a single time. Lazy operands are evaluated as
+# well, so ``lazy1 + lazy2`` works as expected.
+
+UNARY_OPS = (
+    ('__len__', len),
+    ('__iter__', iter),
+    ('__reversed__', reversed),
+    ('__neg__', operator.neg),
+    ('__pos__', operator.pos),
+    ('__abs__', abs),
+    ('__invert__', operator.invert),
+    ('__int__', int),
+    ('__float__', float),
+    ('__complex__', complex),
+    ('__index__', operator.index),
+)
+
+BINARY_OPS = (
+    ('__lt__', operator.lt),
+    ('__le__', operator.le),
+    ('__gt__', operator.gt),
+    ('__ge__', operator.ge),
+    ('__eq__', operator.eq),
+    ('__ne__', operator.ne),
+    ('__contains__', operator.contains),
+    ('__round__', round),
+)
+
+# Arithmetic operators also get a reflected version (e.g., ``__radd__``)
+ARITHMETIC_OPS = (
+    ('add', operator.add),
+    ('sub', operator.sub),
+    ('mul', operator.mul),
+    ('truediv', operator.truediv),
+    ('floordiv', operator.floordiv),
+    ('mod', operator.mod),
+    ('divmod', divmod),
+    ('pow', pow),
+    ('lshift', operator.lshift),
+    ('rshift', operator.rshift),
+    ('and', operator.and_),
+    ('xor', operator.xor),
+    ('or', operator.or_),
+)
+
+if hasattr(operator, 'div'):
+    # Python 2 classic division
+    ARITHMETIC_OPS += (('div', operator.div),)
 
 
 class Lazy(object):
@@ -21,14 +91,29 @@ class Lazy(object):
     stored and passed to the function except the ``_func`` argument which is
     the function itself. Because of this, the wrapped callable cannot use an
     argument named ``_func`` itself.
+
+    Lazy objects are often created in large numbers (e.g., one for each
+    translated string in a template), so they use ``__slots__`` instead of
+    per-instance dicts, and the keyword arguments are not stored when there
+    are none.
+
+    Operators and protocols (arithmetic, comparison, ``len()``, iteration,
+    ``in``, and so on) are delegated to the evaluated value, and each
+    operation evaluates the proxy exactly once. Note that some builtins use
+    more than one protocol (e.g., ``list()`` calls ``len()`` to preallocate
+    before iterating). Use :py:class:`~CachingLazy` where that matters.
     """
 
+    __slots__ = ('_func', '_args', '_kwargs')
+
     def __init__(self, _func, *args, **kwargs):
         self._func = _func
         self._args = args
-        self._kwargs = kwargs
+        self._kwargs = kwargs or None
 
     def _eval(self):
+        if self._kwargs is None:
+            return self._func(*self._args)
         return self._func(*self._args, **self._kwargs)
 
     @staticmethod
@@ -38,6 +123,14 @@ class Lazy(object):
         except AttributeError:
             return other
 
+    def _peek(self):
+        # Return the value if it is known without evaluation, or ``NOTSET``
+        return NOTSET
+
+    def _store(self, value):
+        # Remember a value that was evaluated elsewhere (see ``resolve()``)
+        pass
+
     def __getattr__(self, attr):
         obj = self._eval()
         return getattr(obj, attr)
@@ -68,51 +161,46 @@ class Lazy(object):
     def __format__(self, format_spec):
         return self._eval().__format__(format_spec)
 
-    def __mod__(self, other):
-        return self._eval().__mod__(other)
-
-    # Being explicit about all comparison methods to avoid double-calls
+    def __bool__(self):
+        return bool(self._eval())
 
-    def __lt__(self, other):
-        other = self._eval_other(other)
-        return self._eval() < other
+    __nonzero__ = __bool__
 
-    def __le__(self, other):
-        other = self._eval_other(other)
-        return self._eval() <= other
+    def __hash__(self):
+        return hash(self._eval())
 
-    def __gt__(self, other):
-        other = self._eval_other(other)
-        return self._eval() > other
 
-    def __ge__(self, other):
-        other = self._eval_other(other)
-        return self._eval() >= other
+def _unary_method(name, op):
+    def method(self):
+        return op(self._eval())
+    method.__name__ = str(name)
+    return method
 
-    def __eq__(self, other):
-        other = self._eval_other(other)
-        return self._eval() == other
 
-    def __ne__(self, other):
-        other = self._eval_other(other)
-        return self._eval() != other
+def _binary_method(name, op):
+    def method(self, *args):
+        return op(self._eval(), *[self._eval_other(a) for a in args])
+    method.__name__ = str(name)
+    return method
 
-    # We mostly use this for strings, so having just __add__ is fine
 
-    def __add__(self, other):
-        other = self._eval_other(other)
-        return self._eval() + other
+def _reflected_method(name, op):
+    def method(self, other):
+        return op(self._eval_other(other), self._eval())
+    method.__name__ = str(name)
+    return method
 
-    def __radd__(self, other):
-        return self._eval_other(other) + self._eval()
 
-    def __bool__(self):
-        return bool(self._eval())
+for name, op in UNARY_OPS:
+    setattr(Lazy, name, _unary_method(name, op))
 
-    __nonzero__ = __bool__
+for name, op in BINARY_OPS:
+    setattr(Lazy, name, _binary_method(name, op))
 
-    def __hash__(self):
-        return hash(self._eval())
+for name, op in ARITHMETIC_OPS:
+    name, rname = '__%s__' % name, '__r%s__' % name
+    setattr(Lazy, name, _binary_method(name, op))
+    setattr(Lazy, rname, _reflected_method(rname, op))
 
 
 class CachingLazy(Lazy):
@@ -121,20 +209,161 @@ class CachingLazy(Lazy):
     this class only evaluates the callable once, and remembers the resutls. On
     subsequent use, it returns the original result. This is probably closer to
     the behavior of a normal return value.
+
+    Caching lazy objects are often defined at module level and shared between
+    threads (or greenlets when ``threading`` is monkey-patched by gevent or
+    eventlet). The callable is guaranteed to be evaluated only once even when
+    the first use happens in several threads at the same time. The other
+    threads wait for the result. Once the value is known, it is returned
+    without any locking. The lock is created on first evaluation and discarded
+    afterwards, so it costs nothing for objects that are never evaluated.
     """
 
+    __slots__ = ('_called', '_cached', '_lock')
+
     def __init__(self, _func, *args, **kwargs):
         self._called = False
         self._cached = None
+        self._lock = None
         super(CachingLazy, self).__init__(_func, *args, **kwargs)
 
+    def _get_lock(self):
+        lock = self._lock
+        if lock is None:
+            with LOCK:
+                lock = self._lock
+                if lock is None:
+                    # Reentrant, in case the callable uses the object itself
+                    lock = self._lock = threading.RLock()
+        return lock
+
     def _eval(self):
         if self._called:
             return self._cached
-        self._called = True
-        self._cached = self._func(*self._args, **self._kwargs)
+        with self._get_lock():
+            if not self._called:
+                # The value must be stored before the flag is set, because
+                # other threads read the value as soon as they see the flag
+                self._cached = super(CachingLazy, self)._eval()
+                self._called = True
+                self._lock = None
         return self._cached
 
+    def _peek(self):
+        if self._called:
+            return self._cached
+        return NOTSET
+
+    def _store(self, value):
+        self._cached = value
+        self._called = True
+
+
+class ThreadCachingLazy(Lazy):
+    """
+    Per-thread caching version of the :py:class:`~Lazy` class. The callable
+    is evaluated once in each thread, and the result is only reused within
+    the same thread. This is useful for values that are not safe to share
+    between threads (e.g., database connections).
+    """
+
+    __slots__ = ('_local',)
+
+    def __init__(self, _func, *args, **kwargs):
+        self._local = threading.local()
+        super(ThreadCachingLazy, self).__init__(_func, *args, **kwargs)
+
+    def _eval(self):
+        value = self._peek()
+        if value is NOTSET:
+            value = self._local.value = super(ThreadCachingLazy, self)._eval()
+        return value
+
+    def _peek(self):
+        return getattr(self._local, 'value', NOTSET)
+
+    def _store(self, value):
+        self._local.value = value
+
+
+def request_key():
+    """
+    Return an object that identifies the current request. The object is
+    stored in the request environment, so it is the same for the duration of
+    a request, and different for each request. Returns ``None`` outside of
+    request context.
+    """
+    try:
+        environ = request.environ
+    except RuntimeError:
+        return None
+    if 'REQUEST_METHOD' not in environ:
+        # Bottle binds an empty environment to the request object in the
+        # thread that imported it, so it does not raise outside requests
+        return None
+    key = environ.get(REQUEST_KEY)
+    if key is None:
+        key = environ[REQUEST_KEY] = object()
+    return key
+
+
+class RequestCachingLazy(Lazy):
+    """
+    Request-scoped caching version of the :py:class:`~Lazy` class. The
+    callable is evaluated once per request, and the result is reused until
+    the request changes. This is useful for module-level lazy objects, such as
+    translated messages, which must be evaluated for each request (e.g.,
+    because the locale may differ), but are used many times during a
+    request.
+
+    The cache is keyed by the return value of a key function. The default key
+    function is :py:func:`~request_key`, which identifies the current request.
+    A different key function can be passed using the ``_key`` argument, in
+    which case the cached value is reused as long as the key compares equal to
+    the key under which it was cached. For example, translations only need to
+    be evaluated again when locale changes::
+
+        msg = RequestCachingLazy(translate, 'Hello',
+                                 _key=lambda: request.locale)
+
+    Like ``_func``, ``_key`` is not passed to the wrapped callable, so the
+    callable cannot use an argument named ``_key`` itself.
+
+    If the key function returns ``None`` (e.g., when used outside request
+    context with the default key function), the value is not cached.
+
+    The key and value are stored as a single tuple, so concurrent requests
+    that use the same object never see a value cached for another key.
+    """
+
+    __slots__ = ('_keyfunc', '_cache')
+
+    def __init__(self, _func, *args, **kwargs):
+        self._keyfunc = kwargs.pop('_key', request_key)
+        self._cache = None
+        super(RequestCachingLazy, self).__init__(_func, *args, **kwargs)
+
+    def _eval(self):
+        key = self._keyfunc()
+        cache = self._cache
+        if key is not None and cache is not None and cache[0] == key:
+            return cache[1]
+        value = super(RequestCachingLazy, self)._eval()
+        if key is not None:
+            self._cache = (key, value)
+        return value
+
+    def _peek(self):
+        cache = self._cache
+        if cache is not None and cache[0] == self._keyfunc():
+            return cache[1]
+        return NOTSET
+
+    def _store(self, value):
+        key = self._keyfunc()
+        if key is not None:
+            self._cache = (key, value)
+
 
 def lazy(fn):
     """
@@ -151,23 +380,161 @@ def lazy(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         return Lazy(fn, *args, **kwargs)
+    wrapper.__wrapped__ = fn  # not set by ``wraps()`` on Python 2
     return wrapper
 
 
-def caching_lazy(fn):
+def caching_lazy(fn=None, per_thread=False):
     """
     Convert a function into cached lazily evaluated version. This decorator
     modifies the function to return a :py:class:`~CachingLazy` proxy instead of
     the actual result.
 
-    This decorator has no arguments::
+    The decorator can be used without arguments::
 
         @caching_lazy
         def my_lazy_func():
             return 'foo'
 
+    If ``per_thread`` argument is ``True``, the function returns a
+    :py:class:`~ThreadCachingLazy` proxy, which caches the result separately
+    for each thread::
+
+        @caching_lazy(per_thread=True)
+        def my_lazy_func():
+            return 'foo'
+
     """
+    if fn is None:
+        return lambda fn: caching_lazy(fn, per_thread)
+
+    cls = ThreadCachingLazy if per_thread else CachingLazy
+
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        return CachingLazy(fn, *args, **kwargs)
+        return cls(fn, *args, **kwargs)
+    wrapper.__wrapped__ = fn  # not set by ``wraps()`` on Python 2
     return wrapper
+
+
+def request_caching_lazy(fn=None, key=request_key):
+    """
+    Convert a function into request-scoped cached lazily evaluated version.
+    This decorator modifies the function to return a
+    :py:class:`~RequestCachingLazy` proxy instead of the actual result.
+
+    The decorator can be used without arguments, in which case the result is
+    cached for the duration of a request::
+
+        @request_caching_lazy
+        def my_lazy_func():
+            return 'foo'
+
+    Alternatively, a key function can be passed using the ``key`` argument::
+
+        @request_caching_lazy(key=lambda: request.locale)
+        def my_lazy_func():
+            return 'foo'
+
+    """
+    if fn is None:
+        return lambda fn: request_caching_lazy(fn, key)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return RequestCachingLazy(fn, *args, _key=key, **kwargs)
+    wrapper.__wrapped__ = fn  # not set by ``wraps()`` on Python 2
+    return wrapper
+
+
+def batch_resolver(fn):
+    """
+    Register a function that evaluates several lazy calls to ``fn`` at once.
+    This is used by :py:func:`~resolve` to evaluate all lazy objects that wrap
+    the same function in a single call, which allows backends to perform
+    lookups in bulk (e.g., obtain the translation function once for all
+    messages).
+
+    The ``fn`` argument can either be the function itself, or its version
+    decorated with one of the decorators in this module. The decorated
+    function receives a list of ``(args, kwargs)`` tuples, one for each lazy
+    object, and must return a list of values in the same order::
+
+        @lazy
+        def lookup(key):
+            return db.get(key)
+
+        @batch_resolver(lookup)
+        def lookup_many(calls):
+            keys = [args[0] for args, kwargs in calls]
+            return db.get_many(keys)
+
+    """
+    fn = getattr(fn, '__wrapped__', fn)
+
+    def decorator(batch_fn):
+        BATCH_RESOLVERS[fn] = batch_fn
+        return batch_fn
+    return decorator
+
+
+def _collect(obj, pending, cls=Lazy):
+    if isinstance(obj, cls):
+        pending.setdefault(id(obj), obj)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _collect(value, pending, cls)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _collect(value, pending, cls)
+
+
+def _replace(obj, values, cls=Lazy):
+    if isinstance(obj, cls):
+        return values[id(obj)]
+    if isinstance(obj, dict):
+        return dict((k, _replace(v, values, cls)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [_replace(v, values, cls) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_replace(v, values, cls) for v in obj)
+    return obj
+
+
+def resolve(obj):
+    """
+    Replace all lazy objects in ``obj`` with their values. The object can be
+    a lazy object, or a dict, list, or tuple, which may be nested. This is
+    useful for preparing JSON responses or template contexts that contain many
+    lazy objects (e.g., translated labels).
+
+    Dicts, lists and tuples are copied and the original object is not modified.
+    Any other objects are returned as is.
+
+    Each lazy object is only evaluated once, even if it appears several times.
+    Lazy objects that wrap the same function are evaluated together using the
+    function registered with :py:func:`~batch_resolver`, if any. Caching lazy
+    objects that already hold a value are not evaluated again, and those that
+    don't will remember the value.
+    """
+    pending = {}
+    _collect(obj, pending)
+    values = {}
+    groups = {}
+    for key, lazy_obj in pending.items():
+        value = lazy_obj._peek()
+        if value is NOTSET:
+            groups.setdefault(lazy_obj._func, []).append(lazy_obj)
+        else:
+            values[key] = value
+    for fn, lazy_objs in groups.items():
+        batch_fn = BATCH_RESOLVERS.get(fn)
+        if batch_fn is None:
+            results = [lazy_obj._eval() for lazy_obj in lazy_objs]
+        else:
+            results = batch_fn([(lazy_obj._args, lazy_obj._kwargs or {})
+                                for lazy_obj in lazy_objs])
+        for lazy_obj, value in zip(lazy_objs, results):
+            lazy_obj._store(value)
+            values[id(lazy_obj)] = value
+    return _replace(obj, values)
@@ -0,0 +1,142 @@
+"""
+.. module:: bottle_utils.lazy_async
+   :synopsis: Lazy evaluation of coroutine functions
+
+.. moduleauthor:: Outernet Inc <hello@outernet.is>
+
+This module requires Python 3.5 or newer, and it is not imported by any other
+module in this package.
+"""
+
+import asyncio
+from functools import wraps
+
+from .lazy import resolve, _collect, _replace
+
+__all__ = ('AsyncLazy', 'AsyncCachingLazy', 'async_lazy',
+           'async_caching_lazy', 'resolve_async')
+
+
+class AsyncLazy(object):
+    """
+    Lazy proxy object for coroutine functions. The coroutine function is
+    called each time the proxy is awaited::
+
+        value = await AsyncLazy(fetch_title, page_id)
+
+    Any positional and keyword arguments that are passed to the constructor are
+    stored and passed to the function except the ``_func`` argument which is
+    the function itself. Because of this, the wrapped coroutine function cannot
+    use an argument named ``_func`` itself.
+
+    Unlike :py:class:`~bottle_utils.lazy.Lazy`, this object does not pretend
+    to be the value, because the value can only be obtained by awaiting it.
+    """
+
+    __slots__ = ('_func', '_args', '_kwargs')
+
+    def __init__(self, _func, *args, **kwargs):
+        self._func = _func
+        self._args = args
+        self._kwargs = kwargs
+
+    def _eval(self):
+        return self._func(*self._args, **self._kwargs)
+
+    def __await__(self):
+        return self._eval().__await__()
+
+
+class AsyncCachingLazy(AsyncLazy):
+    """
+    Caching version of the :py:class:`~AsyncLazy` class. The coroutine
+    function is only called once, when the proxy is first awaited, and the
+    result is returned on subsequent awaits. Concurrent awaiters share the
+    same call, so the coroutine is never running more than once.
+
+    If the coroutine raises an exception (or is cancelled), all current
+    awaiters receive the exception, and the coroutine is called again the next
+    time the proxy is awaited. Cancelling one of the awaiters (e.g., when
+    ``asyncio.wait_for()`` times out) does not cancel the shared call, so the
+    other awaiters still receive the result.
+
+    The call is scheduled as a task on the event loop that first awaits the
+    proxy, so the proxy must not be shared between event loops.
+    """
+
+    __slots__ = ('_future',)
+
+    def __init__(self, _func, *args, **kwargs):
+        self._future = None
+        super(AsyncCachingLazy, self).__init__(_func, *args, **kwargs)
+
+    def _eval(self):
+        if self._future is None:
+            self._future = asyncio.ensure_future(
+                super(AsyncCachingLazy, self)._eval())
+            self._future.add_done_callback(self._done)
+        return self._future
+
+    def __await__(self):
+        return asyncio.shield(self._eval()).__await__()
+
+    def _done(self, future):
+        if future.cancelled() or future.exception() is not None:
+            self._future = None
+
+
+def async_lazy(fn):
+    """
+    Convert a coroutine function into lazily evaluated version. This decorator
+    causes the function to return a :py:class:`~AsyncLazy` proxy instead of a
+    coroutine::
+
+        @async_lazy
+        async def my_lazy_func():
+            return 'foo'
+
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return AsyncLazy(fn, *args, **kwargs)
+    return wrapper
+
+
+def async_caching_lazy(fn):
+    """
+    Convert a coroutine function into cached lazily evaluated version. This
+    decorator causes the function to return a :py:class:`~AsyncCachingLazy`
+    proxy instead of a coroutine::
+
+        @async_caching_lazy
+        async def my_lazy_func():
+            return 'foo'
+
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return AsyncCachingLazy(fn, *args, **kwargs)
+    return wrapper
+
+
+async def resolve_async(obj):
+    """
+    Replace all async lazy objects in ``obj`` with their values. All async
+    lazy objects are awaited concurrently, so slow lookups overlap. Synchronous
+    lazy objects are then resolved using
+    :py:func:`bottle_utils.lazy.resolve`. The object can be a lazy object, or
+    a dict, list, or tuple, which may be nested. Dicts, lists and tuples are
+    copied and the original object is not modified.
+
+    This is useful for resolving template contexts before rendering::
+
+        context = await resolve_async(context)
+        return template('page', **context)
+
+    """
+    pending = {}
+    _collect(obj, pending, AsyncLazy)
+    keys = list(pending)
+    results = await asyncio.gather(*[pending[k] for k in keys])
+    values = dict(zip(keys, results))
+    return resolve(_replace(obj, values, AsyncLazy))
@@ -7,7 +7,7 @@
 
 from __future__ import unicode_literals
 
-from .common import attr_escape, html_escape, full_url
+from .common import attr_escape, html_escape, full_url, Markup
 
 
 class MetaBase(object):
@@ -16,8 +16,9 @@ class MetaBase(object):
     functionality for various subclasses.
 
     Currently, the only functionality this base class provides is calling
-    :py:meth:`~render` method when ``__str__()`` magic method is called on the
-    class.
+    :py:meth:`~render` method when ``__str__()`` or ``__html__()`` magic
+    method is called on the class. The latter allows template engines that
+    support it to render the object without escaping.
     """
 
     def render(self):
@@ -25,11 +26,14 @@ class MetaBase(object):
         Render the meta object into HTML. In the base class this method
         renders to empty string.
         """
-        return ''
+        return Markup()
 
     def __str__(self):
         return self.render()
 
+    def __html__(self):
+        return self.render()
+
 
 class SimpleMetadata(MetaBase):
     """
@@ -87,8 +91,8 @@ class SimpleMetadata(MetaBase):
             <meta $attr="$name" content="$value">
 
         """
-        return '<meta %s="%s" content="%s">' % (attr, attr_escape(name),
-                                                attr_escape(value))
+        return Markup('<meta %s="%s" content="%s">' % (
+            attr, attr_escape(name), attr_escape(value)))
 
     def simple(self, name, value):
         """
@@ -112,7 +116,7 @@ class SimpleMetadata(MetaBase):
             s += '<title>%s</title>' % html_escape(self.title)
         if self.description:
             s += self.simple('description', self.description)
-        return super(SimpleMetadata, self).render() + s
+        return super(SimpleMetadata, self).render() + Markup(s)
 
 
 class Metadata(SimpleMetadata):
@@ -308,5 +312,5 @@ class Metadata(SimpleMetadata):
             s += self.ogprop('url', self.url)
             s += self.twitterprop('url', self.url)
             s += self.itemprop('url', self.url)
-        return super(Metadata, self).render() + s
+        return super(Metadata, self).render() + Markup(s)
 
@@ -15,6 +15,7 @@ except ImportError:
     import mock
 
 import bottle_utils.common as mod
+from bottle_utils.lazy import Lazy
 
 
 MOD = 'bottle_utils.common.'
@@ -39,6 +40,23 @@ def test_html_escaping():
     assert mod.html_escape('<foo>bar</foo>') == '&lt;foo&gt;bar&lt;/foo&gt;'
 
 
+def test_escaping_all_characters():
+    s = '&"\n\r\t<>'
+    assert mod.attr_escape(s) == '&amp;&quot;&#10;&#13;&#9;<>'
+    assert mod.html_escape(s) == '&amp;&quot;&#10;&#13;&#9;&lt;&gt;'
+
+
+def test_escaping_without_special_characters():
+    s = 'foo bar'
+    assert mod.attr_escape(s) is s, "Should return the same object"
+    assert mod.html_escape(s) is s, "Should return the same object"
+
+
+def test_escaping_bytes():
+    assert mod.attr_escape_bytes(b'"a&b"') == b'&quot;a&amp;b&quot;'
+    assert mod.html_escape_bytes('<a>') == b'&lt;a&gt;'
+
+
 @mock.patch(MOD + 'request')
 def test_full_url(request):
     request.urlparts.scheme = 'http'
@@ -65,3 +83,39 @@ def test_urlquote_unicode():
     assert mod.urlquote(s) == ('%D0%9E%D0%B2%D0%BE%20%D1%98%D0%B5%20%D1%82%D0%B5'
                            '%D1%81%D1%82')
 
+
+def test_lru_cache():
+    cache = mod.LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert 'b' not in cache, "Least recently used item should be discarded"
+    assert cache.get('a') == 1
+    assert cache.get('b', 'default') == 'default'
+    assert len(cache) == 2
+
+
+def test_lru_cache_missing_key():
+    cache = mod.LRUCache()
+    try:
+        cache['missing']
+    except KeyError:
+        pass
+    else:
+        assert False, "Should raise KeyError"
+
+
+def test_markup():
+    m = mod.Markup('<b>')
+    assert m == '<b>'
+    assert m.__html__() is m
+    assert isinstance(m + mod.Markup('</b>'), mod.Markup)
+    assert not isinstance(m + '</b>', mod.Markup)
+    assert m + Lazy(lambda: '</b>') == '<b></b>'
+
+
+def test_html_escaping_skips_markup():
+    m = mod.Markup('<b>&amp;</b>')
+    assert mod.html_escape(m) is m
+    assert mod.attr_escape(m) == '<b>&amp;amp;</b>'
@@ -99,6 +99,48 @@ def test_tag_content():
     assert mod.tag('foo', 'bar') == '<foo>bar</foo>'
 
 
+def test_tag_returns_markup():
+    assert isinstance(mod.tag('p', 'foo'), mod.Markup)
+    assert isinstance(mod.tag('span', ['a', 'b']), mod.Markup)
+    assert isinstance(mod.form(), mod.Markup)
+
+
+def test_compiled_tag():
+    option = mod.tag.compile('option', _class='x')
+    s = option('foo', value=1)
+    assert s == '<option class="x" value="1">foo</option>'
+    assert isinstance(s, mod.Markup)
+
+
+def test_compiled_tag_matches_tag():
+    option = mod.compile_tag('option', _class='x')
+    assert option('foo') == mod.tag('option', 'foo', _class='x')
+    assert option(['a', 'b']) == mod.tag('option', ['a', 'b'], _class='x')
+
+
+def test_compiled_tag_escapes_attributes():
+    span = mod.compile_tag('span', title='"a"')
+    assert span('', _id='<&>') == (
+        '<span title="&quot;a&quot;" id="<&amp;>"></span>')
+
+
+def test_compiled_tag_override_static_attribute():
+    button = mod.compile_tag('button', _type='submit')
+    assert button('foo', _type='reset') == '<button type="reset">foo</button>'
+
+
+def test_compiled_tag_nonclosing():
+    inp = mod.compile_tag('input', nonclosing=True, _type='text')
+    assert inp('ignored', _name='foo') == '<input type="text" name="foo">'
+
+
+def test_compiled_tag_nonclosing_argument():
+    assert mod.SPAN('x', nonclosing=True) == '<span>'
+    assert mod.SPAN('x', True) == '<span>'
+    assert mod.SPAN('x', nonclosing=False) == '<span>x</span>'
+    assert mod.INPUT('x', nonclosing=False) == '<input>x</input>'
+
+
 def test_tag_content_html():
     assert mod.tag('foo', '<bar>') == '<foo><bar></foo>'
 
@@ -234,6 +276,79 @@ def test_vselect_empty():
     assert mod.tag('option', 'bar', value=1) in s
 
 
+def make_multidict(*pairs):
+    values = mod.MultiDict()
+    for k, v in pairs:
+        values.append(k, v)
+    return values
+
+
+def test_vselect_multiple():
+    values = make_multidict(('foo', '1'), ('foo', '3'))
+    s = mod.vselect('foo', ((1, 'a'), (2, 'b'), (3, 'c')), values,
+                    multiple=None)
+    assert s.count('selected') == 2
+    assert mod.tag('option', 'b', value=2) in s
+
+
+def test_vselect_selection():
+    s = mod.vselect('foo', ((1, 'a'), (2, 'b')), {}, selection={'2'})
+    assert mod.tag('option', 'b', value=2, selected=None) in s
+
+
+def test_selected_values():
+    assert mod.selected_values('foo', {'foo': 'a'}) == {'a'}
+    assert mod.selected_values('foo', {'foo': [1, 2]}) == {'1', '2'}
+    assert mod.selected_values('foo', {'foo': 1}) == {'1'}
+    values = make_multidict(('foo', 'a'), ('foo', 'b'))
+    assert mod.selected_values('foo', values) == {'a', 'b'}
+
+
+def test_vcheckbox_values_changed():
+    values = {'a': ['1']}
+    assert 'checked' not in mod.vcheckbox('a', '2', values)
+    values['a'] = ['2']
+    assert 'checked' in mod.vcheckbox('a', '2', values)
+
+
+def test_vcheckbox_selection():
+    s = mod.vcheckbox('foo', 1, {}, selection={'1'})
+    assert 'checked' in s
+    s = mod.vcheckbox('foo', 2, {'foo': '2'}, selection={'1'})
+    assert 'checked' not in s
+
+
+def test_ivselect():
+    choices = ((1, 'bar'), (2, 'baz'))
+    values = {'foo': 2}
+    fragments = mod.ivselect('foo', iter(choices), values, empty='---')
+    assert not isinstance(fragments, mod.basestring), "Should be iterator"
+    fragments = list(fragments)
+    assert len(fragments) == 5
+    assert ''.join(fragments) == mod.vselect('foo', choices, values,
+                                             empty='---')
+
+
+def test_itag():
+    assert list(mod.itag('li', ['a', 'b'], _class='x')) == [
+        '<li class="x">a</li>', '<li class="x">b</li>']
+    assert list(mod.itag('p', 'foo')) == ['<p>foo</p>']
+
+
+def test_itag_consumes_lazily():
+    def content():
+        yield 'a'
+        raise AssertionError('Should not be consumed')
+    fragments = mod.itag('li', content())
+    assert next(fragments) == '<li>a</li>'
+
+
+def test_iwrap():
+    fragments = mod.iwrap('ul', mod.itag('li', ['a', 'b']), _id='x')
+    assert list(fragments) == [
+        '<ul id="x">', '<li>a</li>', '<li>b</li>', '</ul>']
+
+
 def test_form_tag_default():
     assert mod.form() == '<form>'
 
@@ -510,3 +625,46 @@ def test_full_domain(request, parts, expected, path, with_scheme):
     request.urlparts = urlparse.urlsplit(parts)
     ret = mod.full_url(path=path, with_scheme=with_scheme)
     assert ret == expected
+
+
+@mock.patch(MOD + 'request')
+def test_quoted_url_cached(request):
+    mod.URL_CACHE.clear()
+    request.app.routes = []
+    request.environ = {}
+    request.app.get_url.return_value = '/foo/1'
+    assert mod.quoted_url('foo', id=1) == '/foo/1'
+    assert mod.quoted_url('foo', id=1) == '/foo/1'
+    assert request.app.get_url.call_count == 1
+    mod.quoted_url('foo', id=True)
+    assert request.app.get_url.call_count == 2, "Should not mix up types"
+    request.environ = {'SCRIPT_NAME': '/app'}
+    mod.quoted_url('foo', id=1)
+    assert request.app.get_url.call_count == 3, "Should key by script name"
+    request.app.routes.append(mock.Mock())
+    mod.quoted_url('foo', id=1)
+    assert request.app.get_url.call_count == 4, "Should invalidate on add"
+
+
+@mock.patch(MOD + 'request')
+def test_quoted_url_unhashable_params(request):
+    mod.URL_CACHE.clear()
+    request.app.routes = []
+    request.environ = {}
+    mod.quoted_url('foo', id=[1, 2])
+    mod.quoted_url('foo', id=[1, 2])
+    assert request.app.get_url.call_count == 2
+    assert len(mod.URL_CACHE) == 0
+
+
+def test_quoted_url_with_app():
+    import bottle
+    app = bottle.Bottle()
+    app.route('/foo/<id>', name='foo', callback=lambda id: id)
+    mod.URL_CACHE.clear()
+    environ = {'SCRIPT_NAME': '/app'}
+    with mock.patch.object(mod, 'request', mock.Mock(app=app,
+                                                     environ=environ)):
+        with mock.patch.object(bottle, 'request', mod.request):
+            assert mod.quoted_url('foo', id='a b', x=1) == '/app/foo/a%20b?x=1'
+            assert mod.quoted_url('foo', id='a b', x=1) == '/app/foo/a%20b?x=1'
@@ -0,0 +1,472 @@
+"""
+test_http.py: Unit tests for ``bottle_utils.http`` module
+
+Bottle Utils
+2014 Outernet Inc <hello@outernet.is>
+All rights reserved
+
+Licensed under BSD license. See ``LICENSE`` file in the source directory.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+import zlib
+import tempfile
+
+import mock
+
+import bottle_utils.http as mod
+
+MOD = 'bottle_utils.http.'
+
+real_stat = os.stat
+
+
+def make_file(data=b'0123456789'):
+    f = tempfile.TemporaryFile()
+    f.write(data)
+    f.seek(0)
+    return f
+
+
+def make_request(req, method='GET', **environ):
+    req.method = method
+    req.environ = environ
+
+
+def test_get_fileno():
+    f = make_file()
+    assert mod.get_fileno(f) == f.fileno()
+    assert mod.get_fileno(io.BytesIO(b'foo')) is None
+    assert mod.get_fileno('foo') is None
+
+
+def test_file_range_read():
+    r = mod.FileRange(make_file(), 2, 5)
+    assert r.tell() == 2
+    assert r.read(3) == b'234'
+    assert r.read() == b'56'
+    assert r.read() == b''
+
+
+def test_file_range_fileno():
+    f = make_file()
+    r = mod.FileRange(f, 2, 5)
+    assert r.fileno() == f.fileno()
+
+
+def test_file_range_close():
+    f = make_file()
+    mod.FileRange(f, 2, 5).close()
+    assert f.closed
+
+
+@mock.patch(MOD + 'request')
+def test_send_file(req):
+    make_request(req)
+    f = make_file()
+    resp = mod.send_file(f, 'foo.txt', size=10, timestamp=10)
+    assert resp.status_code == 200
+    assert resp.body is f
+    assert resp.headers['Content-Type'] == 'text/plain; charset=UTF-8'
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_range_file_backed(req):
+    make_request(req, HTTP_RANGE='bytes=2-6')
+    resp = mod.send_file(make_file(), 'foo.mp4', size=10)
+    assert resp.status_code == 206
+    assert isinstance(resp.body, mod.FileRange)
+    assert resp.body.read() == b'23456'
+    assert resp.headers['Content-Range'] == 'bytes 2-6/10'
+    assert resp.headers['Content-Length'] == '5'
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_range_not_file_backed(req):
+    make_request(req, HTTP_RANGE='bytes=2-6')
+    resp = mod.send_file(io.BytesIO(b'0123456789'), 'foo.mp4', size=10)
+    assert resp.status_code == 206
+    assert b''.join(resp.body) == b'23456'
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_range_head(req):
+    make_request(req, 'HEAD', HTTP_RANGE='bytes=2-6')
+    resp = mod.send_file(make_file(), 'foo.mp4', size=10)
+    assert resp.status_code == 206
+    assert resp.body == ''
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_range_not_satisfiable(req):
+    make_request(req, HTTP_RANGE='bytes=20-30')
+    resp = mod.send_file(make_file(), 'foo.mp4', size=10)
+    assert resp.status_code == 416
+
+
+def test_coalesce_ranges():
+    ranges = [(10, 20), (0, 5), (5, 8), (15, 30), (40, 41)]
+    assert mod.coalesce_ranges(ranges) == [(0, 8), (10, 30), (40, 41)]
+
+
+def test_iter_read_ranges():
+    ranges = [(1, 3), (6, 8)]
+    headers = mod.multipart_headers(ranges, 10, 'text/plain', 'XX')
+    body = b''.join(mod.iter_read_ranges(make_file(), ranges, headers, 'XX'))
+    assert body == (b'--XX\r\nContent-Type: text/plain\r\n'
+                    b'Content-Range: bytes 1-2/10\r\n\r\n12\r\n'
+                    b'--XX\r\nContent-Type: text/plain\r\n'
+                    b'Content-Range: bytes 6-7/10\r\n\r\n67\r\n'
+                    b'--XX--\r\n')
+
+
+def test_iter_read_ranges_no_seek():
+    ranges = [(1, 3), (6, 8)]
+    headers = [b'', b'']
+    fd = mock.Mock(spec=['read'])
+    fd.read.side_effect = io.BytesIO(b'0123456789').read
+    body = b''.join(mod.iter_read_ranges(fd, ranges, headers, 'XX'))
+    assert body == b'12\r\n67\r\n--XX--\r\n'
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_multiple_ranges(req):
+    make_request(req, HTTP_RANGE='bytes=6-7,0-1,1-2')
+    resp = mod.send_file(make_file(), 'foo.mp4', size=10)
+    assert resp.status_code == 206
+    ctype = resp.headers['Content-Type']
+    assert ctype.startswith('multipart/byteranges; boundary=')
+    boundary = ctype.split('=')[1]
+    body = b''.join(resp.body)
+    assert int(resp.headers['Content-Length']) == len(body)
+    assert body.count(boundary.encode('latin1')) == 3
+    assert b'Content-Range: bytes 0-2/10\r\n\r\n012\r\n' in body
+    assert b'Content-Range: bytes 6-7/10\r\n\r\n67\r\n' in body
+    assert 'Content-Range' not in resp.headers
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_merged_ranges_single_part(req):
+    make_request(req, HTTP_RANGE='bytes=0-2,3-4')
+    resp = mod.send_file(make_file(), 'foo.mp4', size=10)
+    assert resp.headers['Content-Range'] == 'bytes 0-4/10'
+    assert resp.body.read() == b'01234'
+
+
+def test_make_etag():
+    assert mod.make_etag(10, 1.5) == '"16e360-a"'
+    assert mod.make_etag(10, 1.5) != mod.make_etag(10, 1.6)
+
+
+def test_content_etag():
+    mod.ETAG_CACHE.clear()
+    f = make_file()
+    f.seek(3)
+    etag = mod.content_etag(f, 'foo.txt', 10, 1)
+    assert etag == '"fd1518f063f1067313eb950f97c3553c1987c123"'
+    assert f.tell() == 3, "Should rewind the file"
+    # Cached result is used for the same file
+    assert mod.content_etag(mock.Mock(), 'foo.txt', 10, 1) == etag
+
+
+def test_content_etag_no_seek():
+    mod.ETAG_CACHE.clear()
+    assert mod.content_etag(iter([]), 'foo.txt', 10, 1) is None
+
+
+def test_content_etag_unseekable():
+    mod.ETAG_CACHE.clear()
+    f = mock.Mock()
+    f.tell.side_effect = io.UnsupportedOperation
+    assert mod.content_etag(f, 'foo.txt', 10, 1) is None
+
+
+def test_content_etag_not_cached_without_size_or_timestamp():
+    mod.ETAG_CACHE.clear()
+    first = mod.content_etag(io.BytesIO(b'aaa'), 'x.txt', None, None)
+    second = mod.content_etag(io.BytesIO(b'bbb'), 'x.txt', None, None)
+    assert first != second
+    assert mod.content_etag(io.BytesIO(b'bbb'), 'x.txt', 3, None) == second
+    assert len(mod.ETAG_CACHE) == 0
+
+
+def test_etag_matches():
+    assert mod.etag_matches('"a"', '"b", "a"')
+    assert mod.etag_matches('"a"', 'W/"a"')
+    assert mod.etag_matches('"a"', '*')
+    assert not mod.etag_matches('"a"', '"b"')
+
+
+def test_range_is_current():
+    assert mod.range_is_current(None, '"a"', 10)
+    assert mod.range_is_current('"a"', '"a"', 10)
+    assert not mod.range_is_current('"b"', '"a"', 10)
+    assert not mod.range_is_current('W/"a"', 'W/"a"', 10)
+    assert mod.range_is_current(mod.format_ts(10), '"a"', 10.5)
+    assert not mod.range_is_current(mod.format_ts(10), '"a"', 11)
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_etag(req):
+    make_request(req)
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, timestamp=10)
+    assert resp.headers['ETag'] == mod.make_etag(10, 10)
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, timestamp=10,
+                         etag=False)
+    assert 'ETag' not in resp.headers
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, timestamp=10,
+                         etag=lambda *args: '"foo"')
+    assert resp.headers['ETag'] == '"foo"'
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_if_none_match(req):
+    etag = mod.make_etag(10, 10)
+    make_request(req, HTTP_IF_NONE_MATCH=etag)
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, timestamp=10)
+    assert resp.status_code == 304
+    make_request(req, HTTP_IF_NONE_MATCH='"other"',
+                 HTTP_IF_MODIFIED_SINCE=mod.format_ts(10))
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, timestamp=10)
+    assert resp.status_code == 200, "Should ignore If-Modified-Since"
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_if_modified_since_subsecond(req):
+    make_request(req, HTTP_IF_MODIFIED_SINCE=mod.format_ts(10))
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, timestamp=10.5)
+    assert resp.status_code == 304
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_if_range(req):
+    etag = mod.make_etag(10, 10)
+    make_request(req, HTTP_RANGE='bytes=2-6', HTTP_IF_RANGE=etag)
+    resp = mod.send_file(make_file(), 'foo.mp4', size=10, timestamp=10)
+    assert resp.status_code == 206
+    make_request(req, HTTP_RANGE='bytes=2-6', HTTP_IF_RANGE='"stale"')
+    resp = mod.send_file(make_file(), 'foo.mp4', size=10, timestamp=10)
+    assert resp.status_code == 200
+    assert 'Content-Range' not in resp.headers
+
+
+def test_parse_accept_encoding():
+    assert mod.parse_accept_encoding('gzip, br;q=0.5, *;q=0') == {
+        'gzip': 1.0, 'br': 0.5, '*': 0.0}
+
+
+def test_negotiate_encoding():
+    assert mod.negotiate_encoding('gzip, br', ['br', 'gzip']) == 'br'
+    assert mod.negotiate_encoding('gzip, br;q=0.5', ['br', 'gzip']) == 'gzip'
+    assert mod.negotiate_encoding('*', ['br', 'gzip']) == 'br'
+    assert mod.negotiate_encoding('gzip;q=0', ['gzip']) is None
+    assert mod.negotiate_encoding('', ['gzip']) is None
+
+
+def test_is_compressible():
+    assert mod.is_compressible('text/css; charset=UTF-8')
+    assert mod.is_compressible('application/json')
+    assert not mod.is_compressible('image/png')
+
+
+def test_find_precompressed(tmpdir):
+    path = tmpdir.join('foo.css')
+    path.write('foo')
+    path = str(path)
+    assert mod.find_precompressed(path, 'gzip') == (path, None)
+    tmpdir.join('foo.css.gz').write('foo')
+    assert mod.find_precompressed(path, 'gzip') == (path + '.gz', 'gzip')
+    assert mod.find_precompressed(path, 'br') == (path, 'identity')
+
+
+def test_iter_gzip():
+    data = b'foo' * 100000
+    chunks = list(mod.iter_gzip(io.BytesIO(data), chunksize=1024))
+    assert len(chunks) > 1
+    assert zlib.decompress(b''.join(chunks), 16 + zlib.MAX_WBITS) == data
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_encoding(req):
+    make_request(req)
+    resp = mod.send_file(make_file(), 'foo.css', size=10, timestamp=10,
+                         encoding='br')
+    assert resp.headers['Content-Encoding'] == 'br'
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert resp.headers['ETag'].endswith('-br"')
+    assert resp.headers['Content-Length'] == '10'
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_compress_cached(req):
+    mod.COMPRESS_CACHE.clear()
+    make_request(req, HTTP_ACCEPT_ENCODING='gzip')
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, timestamp=10,
+                         compress=True)
+    body = resp.body.read()
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == b'0123456789'
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Content-Length'] == str(len(body))
+    assert resp.headers['ETag'].endswith('-gzip"')
+    assert ('foo.txt', 10, 10, 6) in mod.COMPRESS_CACHE
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_compress_streaming(req):
+    make_request(req, HTTP_ACCEPT_ENCODING='gzip')
+    resp = mod.send_file(make_file(), 'foo.txt', compress=True)
+    body = b''.join(resp.body)
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == b'0123456789'
+    assert 'Content-Length' not in resp.headers
+    assert 'Accept-Ranges' not in resp.headers
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_compress_not_accepted(req):
+    make_request(req)
+    resp = mod.send_file(make_file(), 'foo.txt', size=10, compress=True)
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    resp = mod.send_file(make_file(), 'foo.png', size=10, compress=True)
+    assert 'Vary' not in resp.headers
+
+
+def make_static(tmpdir, **kwargs):
+    tmpdir.mkdir('static')
+    tmpdir.join('secret.txt').write('secret')
+    tmpdir.join('static', 'foo.txt').write('foo')
+    return mod.StaticFiles(str(tmpdir.join('static')), **kwargs)
+
+
+@mock.patch(MOD + 'request')
+def test_static_files(req, tmpdir):
+    make_request(req)
+    static = make_static(tmpdir)
+    resp = static('foo.txt')
+    assert resp.status_code == 200
+    assert resp.body.read() == b'foo'
+    assert resp.headers['Content-Length'] == '3'
+
+
+@mock.patch(MOD + 'request')
+def test_static_files_outside_root(req, tmpdir):
+    make_request(req)
+    static = make_static(tmpdir)
+    assert static('../secret.txt').status_code == 403
+    assert static('missing.txt').status_code == 404
+
+
+@mock.patch(MOD + 'request')
+@mock.patch(MOD + 'os.stat')
+def test_static_files_stat_cache(stat, req, tmpdir):
+    make_request(req)
+    static = make_static(tmpdir, precompressed=False)
+    stat.side_effect = real_stat
+    static('foo.txt')
+    static('foo.txt')
+    assert stat.call_count == 1, "Should reuse cached stat result"
+    static.ttl = 0
+    static('foo.txt')
+    assert stat.call_count == 2, "Should revalidate after ttl"
+
+
+@mock.patch(MOD + 'request')
+def test_static_files_data_cache(req, tmpdir):
+    make_request(req)
+    static = make_static(tmpdir, ttl=0)
+    static('foo.txt')
+    path = str(tmpdir.join('static', 'foo.txt'))
+    assert static.data_cache[path][2] == b'foo'
+    tmpdir.join('static', 'foo.txt').write('changed')
+    assert static('foo.txt').body.read() == b'changed'
+
+
+@mock.patch(MOD + 'request')
+def test_static_files_large_file(req, tmpdir):
+    make_request(req)
+    static = make_static(tmpdir, max_cached_size=1)
+    resp = static('foo.txt')
+    assert mod.get_fileno(resp.body) is not None, "Should use real file"
+    resp.body.close()
+
+
+@mock.patch(MOD + 'request')
+def test_static_files_precompressed(req, tmpdir):
+    make_request(req, HTTP_ACCEPT_ENCODING='gzip')
+    static = make_static(tmpdir)
+    tmpdir.join('static', 'foo.txt.gz').write('gzipped')
+    resp = static('foo.txt')
+    assert resp.body.read() == b'gzipped'
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Content-Type'] == 'text/plain; charset=UTF-8'
+
+
+@mock.patch(MOD + 'request')
+def test_static_files_compress_when_precompressed_not_accepted(req, tmpdir):
+    mod.COMPRESS_CACHE.clear()
+    make_request(req, HTTP_ACCEPT_ENCODING='gzip')
+    static = make_static(tmpdir, compress=True)
+    tmpdir.join('static', 'foo.txt.br').write('brotli')
+    resp = static('foo.txt')
+    body = resp.body.read()
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == b'foo'
+    assert resp.headers['Content-Encoding'] == 'gzip'
+
+
+@mock.patch(MOD + 'request')
+@mock.patch(MOD + 'find_precompressed')
+def test_static_files_precompressed_removed(find, req, tmpdir):
+    make_request(req, HTTP_ACCEPT_ENCODING='gzip')
+    static = make_static(tmpdir)
+    path = str(tmpdir.join('static', 'foo.txt'))
+    # Sibling is found, but it is gone when it is checked again
+    find.return_value = (path + '.gz', 'gzip')
+    assert static('foo.txt').status_code == 404
+
+
+def test_iter_gzip_closes_file():
+    f = make_file()
+    list(mod.iter_gzip(f))
+    assert f.closed
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_not_modified_closes_content(req):
+    make_request(req, HTTP_IF_NONE_MATCH='"a"')
+    f = make_file()
+    resp = mod.send_file(f, 'foo.txt', size=10, timestamp=1, etag='"a"')
+    assert resp.status_code == 304
+    assert f.closed
+
+
+@mock.patch(MOD + 'request')
+def test_send_file_opener(req):
+    make_request(req)
+    opener = mock.Mock(return_value=make_file())
+    resp = mod.send_file(opener, 'foo.txt', size=10, timestamp=1)
+    assert resp.body.read() == b'0123456789'
+    make_request(req, HTTP_IF_NONE_MATCH=resp.headers['ETag'])
+    opener.reset_mock()
+    resp = mod.send_file(opener, 'foo.txt', size=10, timestamp=1)
+    assert resp.status_code == 304
+    assert not opener.called, "Should not open content for 304"
+
+
+@mock.patch(MOD + 'request')
+def test_static_files_not_opened_when_not_needed(req, tmpdir):
+    mod.COMPRESS_CACHE.clear()
+    static = make_static(tmpdir, compress=True)
+    make_request(req, HTTP_ACCEPT_ENCODING='gzip')
+    etag = static('foo.txt').headers['ETag']
+    with mock.patch.object(static, 'open') as open_:
+        # Compressed content is cached
+        assert static('foo.txt').headers['Content-Encoding'] == 'gzip'
+        make_request(req, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        assert static('foo.txt').status_code == 304
+        make_request(req, method='HEAD')
+        assert static('foo.txt').status_code == 200
+    assert not open_.called
@@ -8,17 +8,66 @@ All rights reserved
 Licensed under BSD license. See ``LICENSE`` file in the source directory.
 """
 
+import io
+import os
+import struct
+
 import mock
+import pytest
 
 import bottle_utils.i18n as mod
+from bottle_utils.lazy import resolve, BATCH_RESOLVERS
 
 MOD = 'bottle_utils.i18n.'
 
 
+MO_HEADER = ('Content-Type: text/plain; charset=UTF-8\n'
+             'Plural-Forms: nplurals=2; plural=(n != 1);\n')
+
+
 def is_lazy(obj):
     return hasattr(obj, '_eval')
 
 
+def make_mo(path, messages):
+    """ Write a .mo file containing ``messages`` dict """
+    messages = dict(messages)
+    messages[''] = MO_HEADER
+    keys = sorted(messages)
+    ids = b''
+    strs = b''
+    offsets = []
+    for key in keys:
+        msgid = key.encode('utf-8')
+        msgstr = messages[key].encode('utf-8')
+        offsets.append((len(ids), len(msgid), len(strs), len(msgstr)))
+        ids += msgid + b'\0'
+        strs += msgstr + b'\0'
+    n = len(keys)
+    ids_start = 7 * 4 + 16 * n
+    strs_start = ids_start + len(ids)
+    data = struct.pack('<7I', 0x950412de, 0, n, 7 * 4, 7 * 4 + 8 * n, 0, 0)
+    for o1, l1, o2, l2 in offsets:
+        data += struct.pack('<2I', l1, ids_start + o1)
+    for o1, l1, o2, l2 in offsets:
+        data += struct.pack('<2I', l2, strs_start + o2)
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as f:
+        f.write(data + ids + strs)
+
+
+@pytest.fixture
+def locale_dir(tmpdir):
+    make_mo(str(tmpdir.join('de', 'LC_MESSAGES', 'messages.mo')), {
+        'foo': 'Fu',
+        'bar\0bars': 'Bar\0Bars',
+        'ctx' + mod.CONTEXT_SEPARATOR + 'foo': 'Kontext',
+    })
+    return str(tmpdir)
+
+
 def test_dummy_gettext():
     _ = mod.dummy_gettext
     assert _('foo') == 'foo', "Should parrot 'foo'"
@@ -72,6 +121,26 @@ def test_lazy_ngettext_request(to_unicode, req):
     assert s == to_unicode.return_value
 
 
+@mock.patch(MOD + 'request')
+def test_resolve_gettext_in_batch(req):
+    req.gettext.gettext.side_effect = lambda s: s.upper()
+    ctx = {'a': mod.lazy_gettext('foo'), 'b': [mod.lazy_gettext('bar')]}
+    with mock.patch.dict(BATCH_RESOLVERS):
+        batch = mock.Mock(side_effect=mod.batch_gettext)
+        BATCH_RESOLVERS[mod.lazy_gettext.__wrapped__] = batch
+        ret = resolve(ctx)
+    assert ret == {'a': 'FOO', 'b': ['BAR']}
+    assert batch.call_count == 1
+
+
+@mock.patch(MOD + 'request')
+def test_batch_ngettext(req):
+    req.gettext.ngettext.side_effect = lambda s, p, n: s if n == 1 else p
+    ret = mod.batch_ngettext([(('foo', 'foos', 1), {}),
+                              (('foo', 'foos', 2), {})])
+    assert ret == ['foo', 'foos']
+
+
 @mock.patch(MOD + 'lazy_gettext')
 def test_lazy_pgettext(lazy_gettext):
     ret = mod.lazy_pgettext('foo', 'bar')
@@ -241,3 +310,429 @@ def test_initialization_warn(warn, BaseTemplate, translation):
                    locale_dir='nonexistent', noplugin=True)
     wcc = warn.call_count
     assert wcc == 2, "Should be called 2 times, got %s" % wcc
+
+
+def test_load_translations(locale_dir):
+    api = mod.load_translations('messages', locale_dir, 'de')
+    assert api.gettext('foo') == 'Fu'
+    assert mod.load_translations('messages', locale_dir, 'de') is not api
+    with pytest.raises(IOError):
+        mod.load_translations('messages', locale_dir, 'fr')
+
+
+def test_compile_catalogs(locale_dir, tmpdir):
+    path = str(tmpdir.join('catalog'))
+    with mock.patch(MOD + 'warn') as warn:
+        mod.compile_catalogs(locale_dir, ['de', 'fr'], path)
+    assert warn.call_count == 1, "Should warn about missing locale"
+    assert not os.path.exists(path + '.tmp')
+    catalogs = mod.CompiledCatalogs(path, ['de', 'fr'])
+    assert 'de' in catalogs
+    assert 'en' not in catalogs
+    assert dict.__len__(catalogs) == 0, "Should not load locales eagerly"
+    api = catalogs['de']
+    assert isinstance(api, mod.gettext.GNUTranslations)
+    assert api.gettext('foo') == 'Fu'
+    assert api.gettext('missing') == 'missing'
+    assert api.ngettext('bar', 'bars', 1) == 'Bar'
+    assert api.ngettext('bar', 'bars', 2) == 'Bars'
+    assert api.gettext('ctx' + mod.CONTEXT_SEPARATOR + 'foo') == 'Kontext'
+    assert catalogs['de'] is api, "Should load locale once"
+    with mock.patch(MOD + 'warn') as warn:
+        assert catalogs['fr'] is mod.gettext
+    assert warn.call_count == 1
+    with pytest.raises(KeyError):
+        catalogs['en']
+
+
+def test_compile_catalogs_fallback(locale_dir, tmpdir):
+    make_mo(str(tmpdir.join('de_AT', 'LC_MESSAGES', 'messages.mo')), {
+        'foo': 'Fuu',
+    })
+    path = str(tmpdir.join('catalog'))
+    mod.compile_catalogs(locale_dir, ['de_AT'], path)
+    api = mod.CompiledCatalogs(path, ['de_AT'])['de_AT']
+    assert api.gettext('foo') == 'Fuu'
+    assert api.ngettext('bar', 'bars', 2) == 'Bars', "Should use fallback"
+    assert api.gettext('missing') == 'missing'
+
+
+@mock.patch(MOD + 'BaseTemplate')
+def test_initialization_with_catalog(BaseTemplate, locale_dir, tmpdir):
+    path = str(tmpdir.join('catalog'))
+    mod.compile_catalogs(locale_dir, ['de'], path)
+    with mock.patch(MOD + 'gettext.translation') as translation:
+        ret = mod.I18NPlugin(mock.Mock(), [('de', 'Deutsch')],
+                             default_locale='de', locale_dir='nonexistent',
+                             noplugin=True, catalog=path)
+    assert not translation.called, "Should not parse .mo files"
+    assert ret.gettext_apis['de'].gettext('foo') == 'Fu'
+
+
+@mock.patch(MOD + 'gettext.translation')
+@mock.patch(MOD + 'BaseTemplate')
+def test_match_locale(BaseTemplate, translation):
+    langs = [('en_US', 'English'), ('pt_BR', 'Portuguese')]
+    plugin = mod.I18NPlugin(mock.Mock(), langs, default_locale='en_US',
+                            locale_dir='nonexistent', noplugin=True,
+                            aliases={'PT': 'pt_BR'})
+    assert plugin.match_locale('/en_us/foo/bar') == 'en_US'
+    assert plugin.match_locale('/EN_US') == 'en_US'
+    assert plugin.match_locale('/pt/foo') == 'pt_BR'
+    assert plugin.match_locale('/pt_br/') == 'pt_BR'
+    assert plugin.match_locale('/foo/en_US/') is None
+    assert plugin.match_locale('/') is None
+    assert plugin.match_locale('') is None
+
+
+@mock.patch(MOD + 'gettext.translation')
+@mock.patch(MOD + 'BaseTemplate')
+def test_alias_for_unsupported_locale(BaseTemplate, translation):
+    with pytest.raises(ValueError):
+        mod.I18NPlugin(mock.Mock(), [('en_US', 'English')],
+                       default_locale='en_US', locale_dir='nonexistent',
+                       noplugin=True, aliases={'pt': 'pt_BR'})
+
+
+def test_strip_prefix():
+    assert mod.I18NPlugin.strip_prefix('/en_US/foo', 'en_US') == '/foo'
+    assert mod.I18NPlugin.strip_prefix('/pt/foo/', 'pt_BR') == '/foo/'
+    assert mod.I18NPlugin.strip_prefix('/en_US/', 'en_US') == '/'
+    assert mod.I18NPlugin.strip_prefix('/en_US', 'en_US') == ''
+
+
+def test_parse_accept_language():
+    mod.ACCEPT_LANGUAGE_CACHE.clear()
+    header = 'de-CH, en;q=0.5, fr;q=0.8, it;q=0, es;q=foo'
+    ret = mod.parse_accept_language(header)
+    assert ret == ('de-ch', 'fr', 'en')
+    assert mod.ACCEPT_LANGUAGE_CACHE.get(header) == ret
+    assert mod.parse_accept_language('') == ()
+
+
+def test_parse_accept_language_keeps_order_for_same_quality():
+    assert mod.parse_accept_language('sr, hr, bs;q=0.9') == ('sr', 'hr', 'bs')
+
+
+def make_i18n_app(**kwargs):
+    import bottle
+    from bottle import request
+    from webtest import TestApp
+    from bottle_utils.http import send_file
+    app = bottle.Bottle()
+
+    @app.get('/')
+    def index():
+        return mod.lazy_gettext('foo')
+
+    @app.get('/file')
+    def download():
+        return send_file(io.BytesIO(b'foo'), 'foo.txt', size=3)
+
+    @app.get('/error')
+    def error():
+        bottle.abort(404)
+
+    @app.get('/moved')
+    def moved():
+        bottle.redirect('/elsewhere')
+
+    @app.get('/path')
+    def path():
+        return {'path': request.original_path}
+
+    @app.get('/nolocale', no_i18n=True)
+    def nolocale():
+        assert request.gettext is mod.NULL_TRANSLATIONS
+        return request.locale
+
+    langs = [('en_US', 'English'), ('de_DE', 'Deutsch'), ('pt_BR', 'Pt')]
+    with mock.patch(MOD + 'warn'):
+        wsgi = mod.I18NPlugin(app, langs, default_locale='en_US',
+                              locale_dir='nonexistent', **kwargs)
+    return TestApp(wsgi)
+
+
+def test_unprefixed_redirects_to_default():
+    app = make_i18n_app()
+    res = app.get('/', headers={'Accept-Language': 'de'})
+    assert res.status_int == 302
+    assert res.location.endswith('/en_US/')
+
+
+def test_unprefixed_redirects_to_negotiated():
+    app = make_i18n_app(negotiate=True)
+    res = app.get('/', headers={'Accept-Language': 'fr, de-AT;q=0.9'})
+    assert res.status_int == 302
+    assert res.location.endswith('/de_DE/')
+    assert 'Accept-Language' in res.headers['Vary']
+    res = app.get('/', headers={'Accept-Language': 'pt-br'})
+    assert res.location.endswith('/pt_BR/')
+    res = app.get('/', headers={'Accept-Language': 'fr'})
+    assert res.location.endswith('/en_US/')
+
+
+def test_cookie_takes_precedence_over_accept_language():
+    app = make_i18n_app(negotiate=True)
+    app.set_cookie('locale', 'pt_BR')
+    res = app.get('/', headers={'Accept-Language': 'de'})
+    assert res.location.endswith('/pt_BR/')
+
+
+def test_serve_unprefixed():
+    app = make_i18n_app(negotiate=True, serve_unprefixed=True)
+    res = app.get('/', headers={'Accept-Language': 'de'})
+    assert res.status_int == 200
+    assert res.text == 'foo'
+    assert res.headers['Content-Language'] == 'de-DE'
+    assert res.headers['Vary'] == 'Accept-Language, Cookie'
+    assert 'Set-Cookie' not in res.headers
+
+
+def test_serve_unprefixed_http_response():
+    app = make_i18n_app(negotiate=True, serve_unprefixed=True)
+    res = app.get('/file', headers={'Accept-Language': 'de'})
+    assert res.body == b'foo'
+    assert res.headers['Content-Language'] == 'de-DE'
+    assert res.headers['Vary'] == 'Accept-Language, Cookie'
+    res = app.get('/error', headers={'Accept-Language': 'de'}, status=404)
+    assert res.headers['Content-Language'] == 'de-DE'
+    assert res.headers['Vary'] == 'Accept-Language, Cookie'
+
+
+def test_serve_unprefixed_redirect_single_vary():
+    app = make_i18n_app(negotiate=True, serve_unprefixed=True)
+    res = app.get('/moved', headers={'Accept-Language': 'de'})
+    assert res.status_int == 302
+    assert res.headers.getall('Vary') == ['Accept-Language, Cookie']
+
+
+def test_set_negotiation_headers_extends_vary():
+    import bottle
+    resp = bottle.HTTPResponse(headers={'Vary': 'Accept-Encoding'})
+    mod.I18NPlugin.set_negotiation_headers(resp, 'de_DE')
+    assert resp.get_header('Vary') == (
+        'Accept-Encoding, Accept-Language, Cookie')
+    assert resp.get_header('Content-Language') == 'de-DE'
+
+
+def test_prefixed_sets_cookie():
+    app = make_i18n_app(negotiate=True, serve_unprefixed=True)
+    res = app.get('/de_de/')
+    assert res.status_int == 200
+    assert 'locale=de_DE' in res.headers['Set-Cookie']
+    assert 'Content-Language' not in res.headers
+
+
+def test_translate_cached(locale_dir):
+    api = mod.load_translations('messages', locale_dir, 'de')
+    with mock.patch.object(api, 'gettext', wraps=api.gettext) as gettext:
+        assert mod.translate(api, 'foo') == 'Fu'
+        assert mod.translate(api, 'foo') == 'Fu'
+    gettext.assert_called_once_with('foo')
+    other = mod.gettext.NullTranslations()
+    assert mod.translate(other, 'foo') == 'foo', "Should cache per API"
+
+
+def test_translate_plural_cached_by_count(locale_dir):
+    api = mod.load_translations('messages', locale_dir, 'de')
+    with mock.patch.object(api, 'ngettext', wraps=api.ngettext) as ngettext:
+        assert mod.translate_plural(api, 'bar', 'bars', 2) == 'Bars'
+        assert mod.translate_plural(api, 'bar', 'bars', 2) == 'Bars'
+        assert mod.translate_plural(api, 'bar', 'bars', 1) == 'Bar'
+        assert mod.translate_plural(api, 'x', 'xs', 1) == 'x'
+        assert mod.translate_plural(api, 'x', 'xs', 2) == 'xs'
+    assert ngettext.call_count == 4
+
+
+def test_translate_cache_size(locale_dir):
+    api = mod.load_translations('messages', locale_dir, 'de')
+    with mock.patch.object(mod, 'TRANSLATION_CACHE_SIZE', 2):
+        assert mod.translate(api, 'foo') == 'Fu'
+        assert mod.translate(api, 'baz') == 'baz'
+        assert mod.translate(api, 'qux') == 'qux'
+        assert api._translation_cache == {'qux': 'qux'}, "Should start over"
+        for n in range(10):
+            mod.translate_plural(api, 'bar', 'bars', n)
+        assert mod.translate(api, 'foo') == 'Fu'
+    assert api._translation_cache == {'qux': 'qux', 'foo': 'Fu'}, (
+        "Plural results should not push out messages")
+
+
+def test_translate_not_cached_for_other_objects():
+    api = mock.Mock()
+    api.gettext.return_value = 'bar'
+    assert mod.translate(api, 'foo') == 'bar'
+    assert mod.translate(api, 'foo') == 'bar'
+    assert api.gettext.call_count == 2
+    assert mod.translate_plural(mod.gettext, 'x', 'xs', 1) == 'x'
+    assert mod.translate_plural(mod.gettext, 'x', 'xs', 2) == 'xs'
+    assert not hasattr(mod.gettext, '_translation_cache')
+
+
+def test_context_key():
+    assert mod.context_key('ctx', 'foo') == 'ctx\x04foo'
+
+
+def test_template_candidates():
+    assert mod.template_candidates('foo', 'de_AT') == [
+        'foo_de_at', 'foo_de', 'foo']
+    assert mod.template_candidates('foo', 'en') == ['foo_en', 'foo']
+
+
+@pytest.fixture
+def template_dir(tmpdir):
+    tmpdir.join('foo.tpl').write('base {{x}}')
+    tmpdir.join('foo_de.tpl').write('de {{x}}')
+    mod.TEMPLATE_CACHE.clear()
+    with mock.patch('bottle.TEMPLATE_PATH', [str(tmpdir)]):
+        yield tmpdir
+    mod.TEMPLATE_CACHE.clear()
+
+
+@mock.patch('bottle.DEBUG', False)
+def test_resolve_template(template_dir):
+    assert mod.resolve_template('foo', 'de_AT') == 'foo_de'
+    assert mod.resolve_template('foo', 'fr_FR') == 'foo'
+    template_dir.join('foo_de_at.tpl').write('at {{x}}')
+    assert mod.resolve_template('foo', 'de_AT') == 'foo_de', "Cached"
+    with mock.patch('bottle.DEBUG', True):
+        assert mod.resolve_template('foo', 'de_AT') == 'foo_de_at'
+
+
+@mock.patch(MOD + 'request')
+@mock.patch(MOD + 'template')
+def test_i18n_view_fallback(template, request, template_dir):
+    request.locale = 'de_AT'
+
+    @mod.i18n_view('foo', x=1)
+    def handler():
+        return {'y': 2}
+
+    assert handler() == template.return_value
+    template.assert_called_once_with('foo_de', x=1, y=2)
+
+
+@mock.patch(MOD + 'request')
+@mock.patch(MOD + 'template')
+def test_i18n_view_without_locale(template, request):
+    request.locale = None
+
+    @mod.i18n_view('foo')
+    def handler():
+        pass
+
+    handler()
+    template.assert_called_once_with('foo')
+
+
+def make_reloading_plugin(locale_dir, **kwargs):
+    with mock.patch(MOD + 'BaseTemplate'):
+        return mod.I18NPlugin(mock.Mock(), [('de', 'Deutsch')],
+                              default_locale='de', locale_dir=locale_dir,
+                              noplugin=True, reload_interval=10, **kwargs)
+
+
+def touch_later(path, seconds=10):
+    mtime = os.stat(path).st_mtime + seconds
+    os.utime(path, (mtime, mtime))
+
+
+@mock.patch(MOD + 'time')
+def test_reload_translations(time, locale_dir):
+    mo_path = os.path.join(locale_dir, 'de', 'LC_MESSAGES', 'messages.mo')
+    time.time.return_value = 1000
+    plugin = make_reloading_plugin(locale_dir)
+    assert plugin.get_translations('de').gettext('foo') == 'Fu'
+    make_mo(mo_path, {'foo': 'Neu'})
+    touch_later(mo_path)
+    time.time.return_value = 1005
+    assert plugin.get_translations('de').gettext('foo') == 'Fu', "Too soon"
+    time.time.return_value = 1011
+    assert plugin.get_translations('de').gettext('foo') == 'Neu'
+
+
+@mock.patch(MOD + 'time')
+def test_reload_translations_keeps_old_on_error(time, locale_dir):
+    mo_path = os.path.join(locale_dir, 'de', 'LC_MESSAGES', 'messages.mo')
+    time.time.return_value = 1000
+    plugin = make_reloading_plugin(locale_dir)
+    with open(mo_path, 'wb') as f:
+        f.write(b'garbage')
+    touch_later(mo_path)
+    time.time.return_value = 1011
+    with mock.patch(MOD + 'warn') as warn:
+        assert plugin.get_translations('de').gettext('foo') == 'Fu'
+    assert warn.call_count == 1
+    make_mo(mo_path, {'foo': 'Neu'})
+    touch_later(mo_path, 20)
+    time.time.return_value = 1022
+    assert plugin.get_translations('de').gettext('foo') == 'Neu'
+
+
+@mock.patch(MOD + 'time')
+def test_reload_catalog(time, locale_dir, tmpdir):
+    mo_path = os.path.join(locale_dir, 'de', 'LC_MESSAGES', 'messages.mo')
+    path = str(tmpdir.join('catalog'))
+    mod.compile_catalogs(locale_dir, ['de'], path)
+    time.time.return_value = 1000
+    plugin = make_reloading_plugin(locale_dir, catalog=path)
+    assert plugin.get_translations('de').gettext('foo') == 'Fu'
+    make_mo(mo_path, {'foo': 'Neu'})
+    mod.compile_catalogs(locale_dir, ['de'], path)
+    touch_later(path)
+    time.time.return_value = 1011
+    assert plugin.get_translations('de').gettext('foo') == 'Neu'
+
+
+def test_no_reload_by_default(locale_dir):
+    with mock.patch(MOD + 'BaseTemplate'):
+        plugin = mod.I18NPlugin(mock.Mock(), [('de', 'Deutsch')],
+                                default_locale='de', locale_dir=locale_dir,
+                                noplugin=True)
+    with mock.patch(MOD + 'os.stat') as stat:
+        plugin.get_translations('de')
+    assert not stat.called
+
+
+def test_locale_cookie_set_when_changed():
+    app = make_i18n_app()
+    res = app.get('/de_DE/path')
+    assert 'locale=de_DE' in res.headers['Set-Cookie']
+
+
+def test_locale_cookie_not_set_when_unchanged():
+    app = make_i18n_app()
+    app.set_cookie('locale', 'de_DE')
+    res = app.get('/de_DE/path')
+    assert 'Set-Cookie' not in res.headers
+
+
+def test_original_path_includes_prefix_and_query():
+    app = make_i18n_app()
+    res = app.get('/de_DE/path?a=1')
+    assert res.json == {'path': '/de_DE/path?a=1'}
+
+
+def test_original_path_computed_on_first_access():
+    import bottle
+    req = bottle.BaseRequest({'PATH_INFO': '/foo', 'QUERY_STRING': 'a=1',
+                              'ORIGINAL_PATH': '/de_DE/foo'})
+    req.environ[mod.OriginalPath.key] = mod.ORIGINAL_PATH
+    with mock.patch(MOD + 'request', req):
+        assert req.original_path == '/de_DE/foo?a=1'
+    assert req.environ[mod.OriginalPath.key] == '/de_DE/foo?a=1'
+
+
+def test_redirect_keeps_query_string():
+    app = make_i18n_app()
+    res = app.get('/path?a=1')
+    assert res.status_int == 302
+    assert res.location.endswith('/en_US/path?a=1')
+
+
+def test_no_i18n_route_uses_shared_null_translations():
+    app = make_i18n_app()
+    app.set_cookie('locale', 'de_DE')
+    assert app.get('/nolocale').text == 'de_DE'
+    assert app.get('/nolocale').text == 'de_DE'
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+test_i18n_tools.py: Unit tests for ``bottle_utils.i18n_tools`` module
+
+Bottle Utils
+2014 Outernet Inc <hello@outernet.is>
+All rights reserved
+
+Licensed under BSD license. See ``LICENSE`` file in the source directory.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+import gettext
+
+import bottle_utils.i18n_tools as mod
+
+
+PY_SOURCE = '''
+from bottle_utils.i18n import lazy_gettext as _, lazy_npgettext
+
+# Translators: greeting shown
+# on the front page
+HELLO = _('Hello "world"')
+JOINED = _('foo '
+           'bar')
+DYNAMIC = _('foo %s' % 1)
+ITEMS = lazy_npgettext('menu', 'item', 'items', 3)
+obj._('method')
+NESTED = _('outer %s') % _('inner')
+UNICODE = _('čevapčići')
+
+
+def _(message):
+    return message
+'''
+
+TPL_SOURCE = '''<h1>{{ _('Title') }}</h1>
+% # Translators: item count
+% # in the cart
+<p>{{! ngettext('one item', 'many items', n) }}</p>
+<%
+  label = pgettext('button',
+                   'Open')
+%>
+<p>{{ 100 % 3 }}</p>
+%% literal _('not code')
+'''
+
+PO_SOURCE = '''# Comment
+msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\\n"
+"Plural-Forms: nplurals=2; plural=(n != 1);\\n"
+
+#: app.py:1
+msgid "Hello"
+msgstr "Hallo"
+
+msgid ""
+"multi\\n"
+"line"
+msgstr "mehr\\n"
+"zeilig"
+
+msgctxt "menu"
+msgid "item"
+msgid_plural "items"
+msgstr[0] "Eintrag"
+msgstr[1] "Einträge"
+
+#, fuzzy
+msgid "Fuzzy"
+msgstr "Unscharf"
+
+msgid "Untranslated"
+msgstr ""
+
+#~ msgid "Obsolete"
+#~ msgstr "Veraltet"
+'''
+
+
+def write(path, content):
+    with io.open(str(path), 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_extract_python():
+    messages = mod.extract_python(PY_SOURCE)
+    assert [m[:4] for m in messages] == [
+        (6, None, 'Hello "world"', None),
+        (7, None, 'foo bar', None),
+        (10, 'menu', 'item', 'items'),
+        (12, None, 'outer %s', None),
+        (12, None, 'inner', None),
+        (13, None, 'čevapčići', None),
+    ]
+    assert messages[0][4] == ['Translators: greeting shown',
+                              'on the front page']
+    assert messages[1][4] == []
+
+
+def test_extract_python_syntax_error():
+    assert mod.extract_python("_('foo'") == []
+
+
+def test_extract_template():
+    messages = mod.extract_template(TPL_SOURCE)
+    assert [m[:4] for m in messages] == [
+        (1, None, 'Title', None),
+        (4, None, 'one item', 'many items'),
+        (6, 'button', 'Open', None),
+    ]
+    assert messages[1][4] == ['Translators: item count', 'in the cart']
+
+
+def test_extract_and_write_pot(tmpdir):
+    write(tmpdir.join('app.py'), PY_SOURCE)
+    tmpdir.mkdir('views')
+    write(tmpdir.join('views', 'page.tpl'), TPL_SOURCE)
+    write(tmpdir.join('views', 'other.tpl'), "{{ _('Title') }}")
+    write(tmpdir.join('README'), "_('ignored')")
+    catalog = mod.extract([str(tmpdir)], jobs=2)
+    assert len(catalog) == 9
+    title = catalog[(None, 'Title')]
+    assert [os.path.basename(p) for p, _ in title['locations']] == [
+        'other.tpl', 'page.tpl']
+    pot = str(tmpdir.join('messages.pot'))
+    mod.write_pot(catalog, pot)
+    with io.open(pot, encoding='utf-8') as f:
+        content = f.read()
+    assert '#. Translators: greeting shown\n#. on the front page\n' in content
+    assert 'msgid "Hello \\"world\\""\nmsgstr ""\n' in content
+    assert ('msgctxt "menu"\nmsgid "item"\nmsgid_plural "items"\n'
+            'msgstr[0] ""\nmsgstr[1] ""\n') in content
+    assert 'msgid "čevapčići"' in content
+
+
+def test_pot_roundtrip(tmpdir):
+    path = str(tmpdir.join('app.py'))
+    write(path, '_("a\\nb")\n_("c\\n")\npgettext("x", "tab\\t\\\\")\n')
+    pot = str(tmpdir.join('messages.pot'))
+    mod.write_pot(mod.extract([path]), pot)
+    entries = mod.read_po(pot)
+    assert [(e['msgctxt'], e['msgid']) for e in entries] == [
+        (None, ''), (None, 'a\nb'), (None, 'c\n'), ('x', 'tab\t\\')]
+    assert 'Content-Type' in entries[0]['msgstr'][0]
+
+
+def test_read_po(tmpdir):
+    write(tmpdir.join('de.po'), PO_SOURCE)
+    entries = mod.read_po(str(tmpdir.join('de.po')))
+    assert [e['msgid'] for e in entries] == [
+        '', 'Hello', 'multi\nline', 'item', 'Fuzzy', 'Untranslated']
+    assert entries[2]['msgstr'] == ['mehr\nzeilig']
+    assert entries[3]['msgctxt'] == 'menu'
+    assert entries[3]['msgstr'] == ['Eintrag', 'Einträge']
+    assert entries[4]['fuzzy']
+    assert not entries[1]['fuzzy']
+
+
+def make_locale_dir(tmpdir):
+    for lang in ('de', 'fr'):
+        lc_dir = tmpdir.mkdir(lang).mkdir('LC_MESSAGES')
+        write(lc_dir.join('messages.po'), PO_SOURCE)
+    return str(tmpdir)
+
+
+def test_compile_mo_files(tmpdir):
+    locale_dir = make_locale_dir(tmpdir)
+    compiled = mod.compile_mo_files(locale_dir, jobs=2)
+    assert [os.path.relpath(p, locale_dir) for p in compiled] == [
+        os.path.join('de', 'LC_MESSAGES', 'messages.mo'),
+        os.path.join('fr', 'LC_MESSAGES', 'messages.mo')]
+    api = gettext.translation('messages', locale_dir, languages=['de'])
+    assert api.gettext('Hello') == 'Hallo'
+    assert api.gettext('multi\nline') == 'mehr\nzeilig'
+    assert api.gettext('Fuzzy') == 'Fuzzy'
+    assert api.ngettext('menu\x04item', 'menu\x04items', 2) == 'Einträge'
+
+
+def test_compile_mo_files_incremental(tmpdir):
+    locale_dir = make_locale_dir(tmpdir)
+    assert len(mod.compile_mo_files(locale_dir, jobs=1)) == 2
+    assert mod.compile_mo_files(locale_dir, jobs=1) == []
+    po = tmpdir.join('de', 'LC_MESSAGES', 'messages.po')
+    mo = tmpdir.join('de', 'LC_MESSAGES', 'messages.mo')
+    os.utime(str(po), (mo.mtime() + 10, mo.mtime() + 10))
+    assert mod.compile_mo_files(locale_dir, jobs=1) == [str(mo)]
+    assert len(mod.compile_mo_files(locale_dir, force=True, jobs=1)) == 2
+
+
+def test_main(tmpdir, capsys):
+    write(tmpdir.join('app.py'), PY_SOURCE)
+    pot = str(tmpdir.join('out.pot'))
+    assert mod.main(['extract', '-o', pot, '-j', '1',
+                     str(tmpdir.join('app.py'))]) == 0
+    assert os.path.exists(pot)
+    locale_dir = make_locale_dir(tmpdir.mkdir('locales'))
+    assert mod.main(['compile', locale_dir, '-j', '1']) == 0
+    catalog = str(tmpdir.join('catalog'))
+    assert mod.main(['catalog', locale_dir, catalog, '-l', 'de']) == 0
+    assert os.path.exists(catalog)
+    out = capsys.readouterr()[0]
+    assert 'Extracted 6 messages' in out
+    assert 'Compiled' in out
@@ -11,11 +11,16 @@ Licensed under BSD license. See ``LICENSE`` file in the source directory.
 from __future__ import unicode_literals
 
 import sys
+import time
+import threading
 try:
     from unittest import mock
 except ImportError:
     import mock
 
+import bottle
+import pytest
+
 import bottle_utils.lazy as mod
 from bottle_utils.common import unicode
 
@@ -255,3 +260,263 @@ def test_methods():
     lazy_obj = lazy_fn()
     assert lazy_obj.replace('bar', 'foo') == 'foofoo'
 
+
+@mock.patch.object(mod, 'request')
+def test_request_key(request):
+    request.environ = {'REQUEST_METHOD': 'GET'}
+    key = mod.request_key()
+    assert key is not None
+    assert mod.request_key() is key
+    request.environ = {'REQUEST_METHOD': 'GET'}
+    assert mod.request_key() is not key
+
+
+def test_request_key_outside_request():
+    # Request object as bound in the thread that imported bottle
+    with mock.patch.object(mod, 'request', bottle.BaseRequest()):
+        assert mod.request_key() is None
+    # Request object that was never bound in this thread
+    keys = []
+    thread = threading.Thread(target=lambda: keys.append(mod.request_key()))
+    thread.start()
+    thread.join()
+    assert keys == [None]
+
+
+def test_request_caching():
+    """ Request caching lazy evaluates once per key """
+    fn = mock.Mock()
+    key = mock.Mock(return_value='foo')
+    lazy = mod.RequestCachingLazy(fn, 1, _key=key)
+    lazy._eval()
+    lazy._eval()
+    assert fn.call_count == 1
+    fn.assert_called_once_with(1)
+    key.return_value = 'bar'
+    lazy._eval()
+    assert fn.call_count == 2
+
+
+def test_request_caching_no_key():
+    """ Request caching lazy does not cache if there is no key """
+    fn = mock.Mock()
+    lazy = mod.RequestCachingLazy(fn, _key=lambda: None)
+    lazy._eval()
+    lazy._eval()
+    assert fn.call_count == 2
+
+
+@mock.patch.object(mod, 'request')
+def test_request_caching_per_request(request):
+    fn = mock.Mock()
+    lazy = mod.RequestCachingLazy(fn)
+    request.environ = {'REQUEST_METHOD': 'GET'}
+    lazy._eval()
+    lazy._eval()
+    assert fn.call_count == 1
+    request.environ = {'REQUEST_METHOD': 'GET'}
+    lazy._eval()
+    assert fn.call_count == 2
+
+
+def test_request_caching_decorator():
+    fn = mock.Mock()
+    fn.__name__ = str('foo')
+    fn.return_value = 'foo'
+    key = mock.Mock(return_value=1)
+    lazy_fn = mod.request_caching_lazy(key=key)(fn)
+    val = lazy_fn(1)
+    assert not fn.called, "Should not be called before value is accessed"
+    assert isinstance(val, mod.RequestCachingLazy)
+    assert val == 'foo'
+    assert val + 'bar' == 'foobar'
+    fn.assert_called_once_with(1)
+
+
+def test_request_caching_decorator_without_args():
+    fn = mock.Mock()
+    fn.__name__ = str('foo')
+    lazy_fn = mod.request_caching_lazy(fn)
+    assert isinstance(lazy_fn(), mod.RequestCachingLazy)
+
+
+def test_sequence_protocol():
+    fn = mock.Mock(return_value='foo')
+    lazy = mod.Lazy(fn)
+    assert len(lazy) == 3
+    assert 'o' in lazy
+    assert list(lazy) == ['f', 'o', 'o']
+    assert list(reversed(lazy)) == ['o', 'o', 'f']
+    assert lazy * 2 == 'foofoo'
+    assert 2 * lazy == 'foofoo'
+
+
+def test_number_protocol():
+    fn = mock.Mock(return_value=7)
+    lazy = mod.Lazy(fn)
+    assert lazy - 2 == 5
+    assert 10 - lazy == 3
+    assert lazy // 2 == 3
+    assert 15 // lazy == 2
+    assert lazy / 2 == 3.5
+    assert divmod(lazy, 2) == (3, 1)
+    assert lazy ** 2 == 49
+    assert pow(lazy, 2, 5) == 4
+    assert 2 ** lazy == 128
+    assert -lazy == -7
+    assert abs(lazy) == 7
+    assert ~lazy == -8
+    assert lazy & 3 == 3
+    assert lazy | 8 == 15
+    assert lazy ^ 1 == 6
+    assert lazy << 1 == 14
+    assert 1 << lazy == 128
+    assert int(lazy) == 7
+    assert float(lazy) == 7.0
+    assert ([0] * 10)[lazy] == 0
+    assert round(mod.Lazy(lambda: 1.26), 1) == 1.3
+
+
+def test_reflected_mod():
+    fn = mock.Mock(return_value='bar')
+    lazy = mod.Lazy(fn)
+    assert 'foo %s' % lazy == 'foo bar'
+
+
+def test_lazy_operands():
+    lazy1 = mod.Lazy(mock.Mock(return_value='foo'))
+    lazy2 = mod.Lazy(mock.Mock(return_value='bar'))
+    assert lazy1 + lazy2 == 'foobar'
+    assert 'o' in mod.Lazy(mock.Mock(return_value='o')) + lazy1
+
+
+def test_operators_evaluate_once():
+    fn = mock.Mock(return_value='foo')
+    lazy = mod.Lazy(fn)
+    for expr in (lambda: len(lazy),
+                 lambda: 'f' in lazy,
+                 lambda: lazy * 2,
+                 lambda: 'x%s' % lazy,
+                 lambda: lazy == 'foo',
+                 lambda: [c for c in lazy]):
+        fn.reset_mock()
+        expr()
+        assert fn.call_count == 1
+
+
+def test_resolve():
+    fn = mock.Mock(side_effect=lambda x: x * 2)
+    lazy1 = mod.Lazy(fn, 1)
+    lazy2 = mod.Lazy(fn, 2)
+    obj = {'a': lazy1, 'b': [lazy2, (lazy1, 3)], 'c': 'foo'}
+    ret = mod.resolve(obj)
+    assert ret == {'a': 2, 'b': [4, (2, 3)], 'c': 'foo'}
+    assert type(ret['b'][0]) is int
+    assert type(ret['b'][1]) is tuple
+    assert fn.call_count == 2, "Same object should be evaluated once"
+    assert obj['a'] is lazy1, "Original should not be modified"
+
+
+def test_resolve_lazy():
+    assert mod.resolve(mod.Lazy(lambda: 'foo')) == 'foo'
+    assert mod.resolve('foo') == 'foo'
+
+
+def test_resolve_batch():
+    fn = mock.Mock()
+    batch = mock.Mock(side_effect=lambda calls: [a[0] + 1 for a, k in calls])
+    with mock.patch.dict(mod.BATCH_RESOLVERS):
+        mod.batch_resolver(fn)(batch)
+        ret = mod.resolve([mod.Lazy(fn, 1), mod.Lazy(fn, 2)])
+    assert ret == [2, 3]
+    assert not fn.called
+    batch.assert_called_once_with([((1,), {}), ((2,), {})])
+
+
+def test_batch_resolver_decorated():
+    fn = mock.Mock()
+    fn.__name__ = str('foo')
+    lazy_fn = mod.lazy(fn)
+    batch = mock.Mock(return_value=['bar'])
+    with mock.patch.dict(mod.BATCH_RESOLVERS):
+        mod.batch_resolver(lazy_fn)(batch)
+        assert mod.resolve([lazy_fn()]) == ['bar']
+    assert not fn.called
+
+
+def test_resolve_caching():
+    fn = mock.Mock(return_value='foo')
+    cached = mod.CachingLazy(fn)
+    cached._eval()
+    fresh = mod.CachingLazy(fn)
+    assert mod.resolve([cached, fresh]) == ['foo', 'foo']
+    assert fn.call_count == 2
+    fresh._eval()
+    assert fn.call_count == 2, "Resolved value should be cached"
+
+
+def test_caching_concurrent_first_use():
+    """ Caching lazy evaluates once when first used by many threads """
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.01)
+        return object()
+
+    lazy = mod.CachingLazy(fn)
+    start = threading.Event()
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(lazy._eval())
+
+    threads = [threading.Thread(target=worker) for _ in range(50)]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len(results) == 50
+    assert all(r is results[0] for r in results)
+    assert lazy._lock is None, "Lock should be discarded after evaluation"
+
+
+def test_caching_failed_evaluation_is_retried():
+    fn = mock.Mock(side_effect=[ValueError, 'foo'])
+    lazy = mod.CachingLazy(fn)
+    with pytest.raises(ValueError):
+        lazy._eval()
+    assert lazy._eval() == 'foo'
+    assert lazy._eval() == 'foo'
+    assert fn.call_count == 2
+
+
+def test_caching_reentrant():
+    lazy = mod.CachingLazy(lambda: lazy._peek() is mod.NOTSET)
+    assert lazy._eval() is True
+
+
+def test_thread_caching():
+    fn = mock.Mock(side_effect=lambda: threading.current_thread().name)
+    lazy = mod.ThreadCachingLazy(fn)
+    assert lazy._eval() == threading.current_thread().name
+    assert lazy._eval() == threading.current_thread().name
+    assert fn.call_count == 1
+    results = []
+    t = threading.Thread(target=lambda: results.append(lazy._eval()),
+                         name='other')
+    t.start()
+    t.join()
+    assert results == ['other']
+    assert fn.call_count == 2
+
+
+def test_caching_decorator_per_thread():
+    fn = mock.Mock()
+    fn.__name__ = str('foo')
+    assert isinstance(mod.caching_lazy(fn)(), mod.CachingLazy)
+    val = mod.caching_lazy(per_thread=True)(fn)()
+    assert isinstance(val, mod.ThreadCachingLazy)
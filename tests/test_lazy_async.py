@@ -0,0 +1,114 @@
+"""
+test_lazy_async.py: Unit tests for ``bottle_utils.lazy_async`` module
+
+Bottle Utils
+2014 Outernet Inc <hello@outernet.is>
+All rights reserved
+
+Licensed under BSD license. See ``LICENSE`` file in the source directory.
+"""
+
+import asyncio
+
+import pytest
+
+import bottle_utils.lazy_async as mod
+from bottle_utils.lazy import Lazy
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def make_counter(value='foo', delay=0):
+    calls = []
+
+    async def fn(*args, **kwargs):
+        calls.append((args, kwargs))
+        await asyncio.sleep(delay)
+        return value
+    return fn, calls
+
+
+def test_async_lazy():
+    fn, calls = make_counter()
+    lazy = mod.AsyncLazy(fn, 1, a=2)
+    assert not calls
+
+    async def main():
+        return (await lazy, await lazy)
+    assert run(main()) == ('foo', 'foo')
+    assert calls == [((1,), {'a': 2})] * 2
+
+
+def test_async_caching_lazy_single_flight():
+    fn, calls = make_counter(delay=0.01)
+    lazy = mod.AsyncCachingLazy(fn)
+
+    async def main():
+        results = await asyncio.gather(*[lazy for _ in range(10)])
+        return results + [await lazy]
+    assert run(main()) == ['foo'] * 11
+    assert len(calls) == 1
+
+
+def test_async_caching_lazy_cancelled_awaiter():
+    fn, calls = make_counter(delay=0.1)
+    lazy = mod.AsyncCachingLazy(fn)
+
+    async def get():
+        return await lazy
+
+    async def main():
+        other = asyncio.ensure_future(get())
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(get(), 0.01)
+        return await other
+    assert run(main()) == 'foo'
+    assert len(calls) == 1
+
+
+def test_async_caching_lazy_retries_after_failure():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError()
+        return 'foo'
+    lazy = mod.AsyncCachingLazy(fn)
+
+    async def main():
+        with pytest.raises(ValueError):
+            await lazy
+        return await lazy
+    assert run(main()) == 'foo'
+    assert len(calls) == 2
+
+
+def test_decorators():
+    fn, calls = make_counter()
+    assert isinstance(mod.async_lazy(fn)(), mod.AsyncLazy)
+    assert isinstance(mod.async_caching_lazy(fn)(), mod.AsyncCachingLazy)
+    assert not calls
+
+
+def test_resolve_async_is_concurrent():
+    fn, calls = make_counter(delay=0.1)
+    slow = mod.async_lazy(fn)
+    ctx = {'a': slow(1), 'b': [slow(2), (slow(3), 'x')],
+           'c': Lazy(lambda: 'bar')}
+    loop = asyncio.new_event_loop()
+    try:
+        start = loop.time()
+        ret = loop.run_until_complete(mod.resolve_async(ctx))
+        elapsed = loop.time() - start
+    finally:
+        loop.close()
+    assert ret == {'a': 'foo', 'b': ['foo', ('foo', 'x')], 'c': 'bar'}
+    assert len(calls) == 3
+    assert elapsed < 0.25, "Lookups should overlap"
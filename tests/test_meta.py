@@ -38,6 +38,18 @@ def test_simple():
     assert str(m) == ''
 
 
+def test_render_returns_markup():
+    m = mod.Metadata(title='foo', description='bar')
+    s = m.render()
+    assert isinstance(s, mod.Markup)
+    assert m.__html__() == s
+
+
+def test_simple_title_markup_not_escaped():
+    m = mod.SimpleMetadata(title=mod.Markup('&amp;'))
+    assert '<title>&amp;</title>' in m.render()
+
+
 def test_simple_title():
     m = mod.SimpleMetadata(title='foo')
     s = m.render()